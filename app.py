@@ -1,27 +1,48 @@
 import os
+import json
+import uuid
 import cv2
 import streamlit as st
 import numpy as np
-from ultralytics import YOLO
-
-# Define folders
-UPLOAD_FOLDER = "static/uploads"
-RESULT_FOLDER = "static/results"
-CROPPED_FOLDER = "static/cropped"
-
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(RESULT_FOLDER, exist_ok=True)
-os.makedirs(CROPPED_FOLDER, exist_ok=True)
-
-# Load YOLO models
-person_model = YOLO("weights/person_detection.pt")
-ppe_model = YOLO("weights/ppe_detection.pt")
-
-# Define PPE class names
-PPE_CLASSES = ["hard-hat", "gloves", "mask", "glasses", "boots", "vest", "ppe-suit", "ear-protector", "safety-harness"]
+from detection_output import detection_record
+from frame_gate import DEDUP_THRESHOLD, FrameGate
+from metrics import METRICS
+from ppe_pipeline import LRUCache, PPEPipeline, content_key, draw_detections, expand_boxes, startup_line
+
+# Set PPE_AUDIT=1 to also keep each upload, its person crops and the result on disk,
+# in a folder unique to the request. By default everything stays in memory.
+AUDIT_MODE = os.environ.get("PPE_AUDIT") == "1"
+AUDIT_FOLDER = "static/audit"
+
+# Number of processed uploads kept in memory across reruns and sessions
+RESULT_CACHE_SIZE = 32
+
+@st.cache_resource
+def get_pipeline():
+    """Starts loading the person -> PPE pipeline once per process in the background, so the
+    page renders right away; reruns reuse the same models and detection waits for them."""
+    return PPEPipeline().load_async()
+
+@st.cache_resource
+def get_result_cache():
+    """Process-wide LRU of annotated results and detection records keyed by upload content and settings."""
+    return LRUCache(maxsize=RESULT_CACHE_SIZE, name="result")
+
+@st.cache_resource
+def get_frame_gate():
+    """Process-wide near-duplicate gate (PPE_DEDUP_THRESHOLD > 0); each session is its own source."""
+    return FrameGate(DEDUP_THRESHOLD) if DEDUP_THRESHOLD > 0 else None
+
+def session_source():
+    """Frame gate source of the current browser session, so one user's uploads are never
+    answered with the results of another user's similar image."""
+    if "gate_source" not in st.session_state:
+        st.session_state.gate_source = f"upload-{uuid.uuid4().hex}"
+    return st.session_state.gate_source
 
 # Streamlit page config
 st.set_page_config(page_title="PPE Detection", layout="wide")
+pipeline = get_pipeline()
 
 # Custom CSS for dark mode UI
 st.markdown(
@@ -83,6 +104,10 @@ st.markdown(
 st.sidebar.markdown("<h2 style='color:#1abc9c;'>⚙ Settings</h2>", unsafe_allow_html=True)
 theme_option = st.sidebar.radio("Choose Theme", ["Dark Mode", "Light Mode"], index=0)
 st.sidebar.markdown("---")
+if pipeline.ready:
+    st.sidebar.caption(f"Models ready ({startup_line()})")
+else:
+    st.sidebar.caption("Loading detection models in the background...")
 
 # Apply theme
 if theme_option == "Light Mode":
@@ -106,89 +131,97 @@ st.markdown("<p class='subheader'>📤 Upload an image to detect persons and PPE
 # File Upload
 uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "png", "jpeg"])
 
-def draw_text_with_bg(img, text, x, y, font=cv2.FONT_HERSHEY_SIMPLEX, 
-                      font_scale=0.7, font_thickness=2, text_color=(0, 255, 0), bg_color=(0, 0, 0)):
-    """Draws text with a background for better visibility."""
-    text_size = cv2.getTextSize(text, font, font_scale, font_thickness)[0]
-    x_end, y_end = x + text_size[0] + 10, y - text_size[1] - 5
+def save_audit_files(file_bytes, file_name, image, result):
+    """Writes the upload and the padded person crops the PPE model saw (assessable persons only,
+    named by person index) to a new per-request audit folder and returns it."""
+    request_folder = os.path.join(AUDIT_FOLDER, uuid.uuid4().hex)
+    os.makedirs(request_folder)
 
-    cv2.rectangle(img, (x, y - text_size[1] - 5), (x_end, y_end + 10), bg_color, -1)
-    cv2.putText(img, text, (x + 5, y - 5), font, font_scale, text_color, font_thickness)
+    with open(os.path.join(request_folder, os.path.basename(file_name)), "wb") as f:
+        f.write(file_bytes)
 
-def detect_ppe(image_path):
-    """Performs person and PPE detection, returning the processed image path."""
-    image = cv2.imread(image_path)
-    original_image = image.copy()
+    crop_boxes = expand_boxes(result.person_boxes, image.shape, pipeline.crop_padding)
+    for idx in np.flatnonzero(result.person_assessable):
+        x1, y1, x2, y2 = map(int, crop_boxes[idx])
+        cv2.imwrite(os.path.join(request_folder, f"person_{idx}.jpg"), image[y1:y2, x1:x2])
 
-    # Step 1: Detect Persons
-    person_results = person_model(image)
-    cropped_persons = []
+    return request_folder
 
-    for result in person_results:
-        boxes = result.boxes.xyxy.cpu().numpy()
-        for idx, box in enumerate(boxes):
-            x1, y1, x2, y2 = map(int, box)
+def detect_ppe(file_bytes, file_name):
+    """Performs person and PPE detection in memory, returning annotated JPEG bytes and detections."""
+    image = cv2.imdecode(np.frombuffer(file_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None, None
 
-            cv2.rectangle(original_image, (x1, y1), (x2, y2), (255, 0, 0), 2)
-            draw_text_with_bg(original_image, "Person", x1, y1, text_color=(255, 0, 0))
+    if not pipeline.ready:
+        with st.spinner("Loading detection models..."):
+            pipeline.wait_ready()
 
-            cropped_image = image[y1:y2, x1:x2].copy()
-            cropped_path = os.path.join(CROPPED_FOLDER, f"person_{idx}.jpg")
-            cv2.imwrite(cropped_path, cropped_image)
-            cropped_persons.append((cropped_image, (x1, y1)))
+    gate = get_frame_gate()
+    result = gate.detect(pipeline, image, source=session_source())[0] if gate else pipeline.detect(image)
 
-    # Step 2: Detect PPE on Cropped Persons
-    for cropped_image, (x1, y1) in cropped_persons:
-        ppe_results = ppe_model(cropped_image)
+    audit_folder = save_audit_files(file_bytes, file_name, image, result) if AUDIT_MODE else None
 
-        for ppe_result in ppe_results:
-            ppe_boxes = ppe_result.boxes.xyxy.cpu().numpy()
-            ppe_classes = ppe_result.boxes.cls.cpu().numpy()
+    # Draw straight onto the decoded frame and encode the result into memory
+    draw_detections(image, result)
+    with METRICS.timer("encode"):
+        result_bytes = cv2.imencode(".jpg", image)[1].tobytes()
 
-            for i, ppe_box in enumerate(ppe_boxes):
-                px1, py1, px2, py2 = map(int, ppe_box)
-                px1 += x1
-                py1 += y1
-                px2 += x1
-                py2 += y1
+    if audit_folder:
+        with open(os.path.join(audit_folder, "result.jpg"), "wb") as f:
+            f.write(result_bytes)
 
-                class_id = int(ppe_classes[i])
-                label = PPE_CLASSES[class_id] if class_id < len(PPE_CLASSES) else "PPE"
+    return result_bytes, result
 
-                cv2.rectangle(original_image, (px1, py1), (px2, py2), (0, 255, 0), 2)
-                draw_text_with_bg(original_image, label, px1, py1, text_color=(0, 255, 0))
+def detect_ppe_cached(uploaded_file):
+    """Returns (annotated JPEG bytes, JSON detections) for an upload, running detection only on a cache miss."""
+    file_bytes = uploaded_file.getvalue()
+    cache_key = content_key(file_bytes, pipeline.settings)
+    result_cache = get_result_cache()
 
-    # Save the output image
-    result_path = os.path.join(RESULT_FOLDER, os.path.basename(image_path))
-    cv2.imwrite(result_path, original_image)
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        st.markdown("### Processing Image... ⏳")
+        result_bytes, result = detect_ppe(file_bytes, uploaded_file.name)
+        if result_bytes is None:
+            return None, None
 
-    return result_path
+        detections_json = json.dumps(detection_record(uploaded_file.name, result), indent=2)
+        cached = (result_bytes, detections_json)
+        result_cache.put(cache_key, cached)
 
-if uploaded_file:
-    # Save uploaded image
-    file_path = os.path.join(UPLOAD_FOLDER, uploaded_file.name)
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    return cached
 
+if uploaded_file:
     # Show uploaded image
-    st.image(file_path, caption="Uploaded Image", use_column_width=True)
+    st.image(uploaded_file, caption="Uploaded Image", use_column_width=True)
 
-    # Perform inference
-    st.markdown("### Processing Image... ⏳")
-    result_image_path = detect_ppe(file_path)
+    # Perform inference (memoized across reruns such as theme toggles)
+    result_bytes, detections_json = detect_ppe_cached(uploaded_file)
 
-    # Show result image
-    st.image(result_image_path, caption="Detected PPE", use_column_width=True)
+    if result_bytes is None:
+        st.error("❌ Could not read the uploaded image.")
+    else:
+        # Show result image
+        st.image(result_bytes, caption="Detected PPE", use_column_width=True)
 
-    # Download button for processed image
-    with open(result_image_path, "rb") as file:
+        # Download button for processed image
         st.download_button(
             label="📥 Download Processed Image",
-            data=file,
+            data=result_bytes,
             file_name="ppe_detected.jpg",
             mime="image/jpeg",
             help="Click to download the processed image",
         )
 
+        # Download button for machine-readable detections
+        st.download_button(
+            label="📄 Download Detections (JSON)",
+            data=detections_json,
+            file_name="ppe_detections.json",
+            mime="application/json",
+            help="Person and PPE boxes, class names and confidences",
+        )
+
 # Footer
 st.markdown("<p class='footer'>Developed by <b>Taufiq Ahmed I</b></p>", unsafe_allow_html=True)
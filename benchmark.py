@@ -0,0 +1,280 @@
+import os
+
+# Benchmarks are CPU-only, must not reach the network and skip the per-call Ultralytics logs
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+os.environ.setdefault("YOLO_OFFLINE", "True")
+os.environ.setdefault("YOLO_VERBOSE", "False")
+
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from inference import IMAGE_EXTENSIONS, _init_worker, list_images, process_images
+from ppe_pipeline import (DEFAULT_BACKEND, DetectionResult, PPEPipeline, collect_crops, detect_ppe_on_crops,
+                          draw_detections, startup_line, startup_report)
+
+# Stages timed per image, in pipeline order
+FRAME_STAGES = ["decode", "person", "crop", "ppe", "draw", "encode"]
+CROP_STAGES = ["decode", "ppe", "draw", "encode"]
+
+PERCENTILES = [50, 95, 99]
+
+def list_images_recursive(folder):
+    """Returns the sorted paths of all images below a folder (cropped_persons has train/ and val/)."""
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(folder)
+        for name in names
+        if name.endswith(IMAGE_EXTENSIONS)
+    )
+
+def git_commit():
+    """Returns the short commit hash of the working tree, with a -dirty suffix if it has changes."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process and its finished children in MB."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+def summarize(samples_ms):
+    """Returns count, mean and latency percentiles of a list of millisecond timings."""
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if len(samples) == 0:
+        return {"n": 0}
+    summary = {"n": len(samples), "mean": float(samples.mean())}
+    for p, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+        summary[f"p{p}"] = float(value)
+    return summary
+
+def time_frames(pipeline, image_paths):
+    """Runs the two-pass pipeline stage by stage over full frames and returns per-stage timings."""
+    timings = {stage: [] for stage in FRAME_STAGES + ["total"]}
+    persons = []
+    for image_path in image_paths:
+        t0 = time.perf_counter()
+        image = cv2.imread(image_path)
+        t1 = time.perf_counter()
+        if image is None:
+            continue
+        person_boxes, person_scores = pipeline.detect_persons(image)
+        t2 = time.perf_counter()
+        crop_boxes, assessable = pipeline.crop_boxes(image.shape, person_boxes)
+        crops, owners = collect_crops([image], [crop_boxes], [assessable])
+        t3 = time.perf_counter()
+        ppe = detect_ppe_on_crops(pipeline.ppe_model, crops, owners, 1, max_batch_size=pipeline.max_batch_size,
+                                  imgsz=pipeline.ppe_imgsz, buffer=pipeline.letterbox_buffer)[0]
+        t4 = time.perf_counter()
+        draw_detections(image, DetectionResult(person_boxes, person_scores, *ppe, person_assessable=assessable))
+        t5 = time.perf_counter()
+        cv2.imencode(".jpg", image)
+        t6 = time.perf_counter()
+
+        marks = [t0, t1, t2, t3, t4, t5, t6]
+        for stage, start, end in zip(FRAME_STAGES, marks, marks[1:]):
+            timings[stage].append((end - start) * 1000)
+        timings["total"].append((t6 - t0) * 1000)
+        persons.append(len(person_boxes))
+
+    return {
+        "images": len(timings["total"]),
+        "mean_persons": float(np.mean(persons)) if persons else 0.0,
+        "stages": {stage: summarize(samples) for stage, samples in timings.items()},
+    }
+
+def time_crops(pipeline, image_paths):
+    """Runs only the PPE model over person crops and returns per-stage timings."""
+    timings = {stage: [] for stage in CROP_STAGES + ["total"]}
+    for image_path in image_paths:
+        t0 = time.perf_counter()
+        image = cv2.imread(image_path)
+        t1 = time.perf_counter()
+        if image is None:
+            continue
+        result = pipeline.detect_crop(image)
+        t2 = time.perf_counter()
+        draw_detections(image, result, draw_persons=False)
+        t3 = time.perf_counter()
+        cv2.imencode(".jpg", image)
+        t4 = time.perf_counter()
+
+        marks = [t0, t1, t2, t3, t4]
+        for stage, start, end in zip(CROP_STAGES, marks, marks[1:]):
+            timings[stage].append((end - start) * 1000)
+        timings["total"].append((t4 - t0) * 1000)
+
+    return {
+        "images": len(timings["total"]),
+        "stages": {stage: summarize(samples) for stage, samples in timings.items()},
+    }
+
+def sweep_batch_sizes(pipeline, image_paths, batch_sizes):
+    """Measures detect_batch throughput on pre-decoded frames for each person/PPE batch size."""
+    images = [image for image in map(cv2.imread, image_paths) if image is not None]
+    default_batch = pipeline.max_batch_size
+    rows = []
+    for batch_size in batch_sizes:
+        pipeline.max_batch_size = batch_size
+        start = time.perf_counter()
+        for i in range(0, len(images), batch_size):
+            pipeline.detect_batch(images[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        rows.append({"batch_size": batch_size, "images": len(images), "seconds": elapsed,
+                     "images_per_sec": len(images) / elapsed if elapsed else 0.0})
+        print(f"   batch {batch_size:>3}: {rows[-1]['images_per_sec']:.2f} images/sec")
+    pipeline.max_batch_size = default_batch
+    return rows
+
+def _bench_shard(shard):
+    # Same work as inference._process_shard, with its per-image log lines silenced
+    image_paths, output_folder, backend = shard
+    with contextlib.redirect_stdout(io.StringIO()):
+        return process_images(image_paths, output_folder, pipeline=PPEPipeline(backend=backend))
+
+def sweep_workers(image_paths, worker_counts, backend):
+    """Measures end-to-end inference.py throughput (decode to JPEG write) across process counts.
+
+    Every worker process loads its own models, so the timings include that start-up cost just
+    like a real `inference.py --processes N` run.
+    """
+    rows = []
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory() as output_folder:
+            shards = [(image_paths[i::workers], output_folder, backend) for i in range(workers)]
+            threads_per_process = max(1, (os.cpu_count() or 1) // workers)
+            start = time.perf_counter()
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(threads_per_process,)) as pool:
+                processed = sum(pool.map(_bench_shard, shards))
+            elapsed = time.perf_counter() - start
+        rows.append({"workers": workers, "images": processed, "seconds": elapsed,
+                     "images_per_sec": processed / elapsed if elapsed else 0.0})
+        print(f"   {workers:>3} workers: {rows[-1]['images_per_sec']:.2f} images/sec")
+    return rows
+
+def print_stages(title, section):
+    print(f"📊 {title} ({section['images']} images)")
+    print(f"{'stage':<10}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}  (ms)")
+    for stage, summary in section["stages"].items():
+        if summary["n"]:
+            print(f"{stage:<10}{summary['mean']:>9.2f}{summary['p50']:>9.2f}"
+                  f"{summary['p95']:>9.2f}{summary['p99']:>9.2f}")
+
+def compare_results(baseline, current):
+    """Prints p50 stage latencies and throughputs of two result files side by side."""
+    print(f"📊 {baseline['meta']['commit']} -> {current['meta']['commit']}")
+    print(f"{'metric':<28}{'before':>10}{'after':>10}{'change':>9}")
+
+    def row(name, before, after):
+        if before is None or after is None:
+            return
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{name:<28}{before:>10.2f}{after:>10.2f}{change:>+8.1f}%")
+
+    for section in ["frames", "crops"]:
+        for stage, summary in current.get(section, {}).get("stages", {}).items():
+            before = baseline.get(section, {}).get("stages", {}).get(stage, {})
+            row(f"{section}.{stage} p50 ms", before.get("p50"), summary.get("p50"))
+    for key, label in [("batch_sizes", "batch_size"), ("workers", "workers")]:
+        before = {r[label]: r["images_per_sec"] for r in baseline.get(key, [])}
+        for r in current.get(key, []):
+            row(f"{label} {r[label]} images/sec", before.get(r[label]), r["images_per_sec"])
+
+def main():
+    parser = ArgumentParser(description="Benchmark the person and PPE detection pipeline on CPU.")
+    parser.add_argument("--images", default="datasets/images", help="Folder with full-frame images.")
+    parser.add_argument("--crops", default="datasets/cropped_persons", help="Folder with person crops.")
+    parser.add_argument("--limit", type=int, default=100, help="Images per dataset; 0 for all.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16],
+                        help="Batch sizes for the throughput sweep.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2],
+                        help="Process counts for the end-to-end throughput sweep.")
+    parser.add_argument("--backend", default=DEFAULT_BACKEND, help="Model backend, as for PPE_BACKEND.")
+    parser.add_argument("--output", help="Results JSON (default benchmarks/<commit>.json).")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against.")
+    args = parser.parse_args()
+
+    frame_paths = list_images(args.images)
+    crop_paths = list_images_recursive(args.crops)
+    if args.limit:
+        frame_paths, crop_paths = frame_paths[:args.limit], crop_paths[:args.limit]
+    if not frame_paths:
+        print(f"❌ Error: No images found in {args.images}!")
+        return
+
+    pipeline = PPEPipeline(backend=args.backend, route="two-pass")
+    pipeline.load()
+    pipeline.warmup()
+    startup = startup_report()
+    print(f"⏱️ Startup: {startup_line()}")
+
+    import torch
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "backend": args.backend,
+            "person_weights": pipeline.person_weights,
+            "ppe_weights": pipeline.ppe_weights,
+        },
+        "import_seconds": startup["import"],
+        "load_seconds": startup["load"],
+        "warmup_seconds": startup["warmup"],
+    }
+
+    results["frames"] = time_frames(pipeline, frame_paths)
+    if crop_paths:
+        results["crops"] = time_crops(pipeline, crop_paths)
+    print_stages(f"Full frames from {args.images}", results["frames"])
+    if crop_paths:
+        print_stages(f"Person crops from {args.crops}", results["crops"])
+
+    print("🔄 Batch size sweep...")
+    results["batch_sizes"] = sweep_batch_sizes(pipeline, frame_paths, args.batch_sizes)
+    print("🔄 Worker sweep...")
+    results["workers"] = sweep_workers(frame_paths, args.workers, args.backend)
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    if results["peak_rss_mb"]:
+        print(f"💾 Peak RSS: {results['peak_rss_mb']['self']:.0f} MB "
+              f"(worker processes: {results['peak_rss_mb']['children']:.0f} MB)")
+
+    output = args.output or os.path.join("benchmarks", f"{results['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Benchmark results saved in {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+import hashlib
+import json
+import os
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass
+import numpy as np
+from detection_output import iter_records
+from ppe_pipeline import PPE_CLASSES, assign_to_persons
+
+# PPE every person must wear unless the rules file says otherwise for their camera
+DEFAULT_REQUIRED = ["hard-hat", "vest"]
+
+# Running summary file updated by compliance.py --records and by video_inference.py --summary
+DEFAULT_SUMMARY = "results/compliance_summary.json"
+
+# Records evaluated per vectorized chunk when summarizing a records file
+RECORD_CHUNK = 4096
+
+# Bytes at the start and at the end of the already-added part of a JSONL records file that are
+# hashed to tell a file that was appended to from one that was rewritten
+CHECK_BYTES = 4096
+
+# Summary counters per (camera, hour): persons, assessable persons and persons in violation,
+# then per PPE class the assessable persons missing it and all persons wearing it
+TOTAL_COLUMNS = ["persons", "assessable", "violations"]
+SUMMARY_COLUMNS = (TOTAL_COLUMNS + [f"missing:{name}" for name in PPE_CLASSES]
+                   + [f"worn:{name}" for name in PPE_CLASSES])
+
+
+def class_mask(names):
+    """Returns a boolean mask over PPE_CLASSES selecting the given class names."""
+    unknown = set(names) - set(PPE_CLASSES)
+    if unknown:
+        raise ValueError(f"Unknown PPE classes {sorted(unknown)}; expected some of {PPE_CLASSES}")
+    return np.isin(PPE_CLASSES, list(names))
+
+
+class ComplianceRules:
+    """Required PPE per camera (zone), with a default for cameras without their own rule.
+
+    The rules file is JSON: {"default": ["hard-hat", "vest"], "cameras": {"welding": [..., "mask"]}}.
+    """
+
+    def __init__(self, default=DEFAULT_REQUIRED, cameras=None):
+        self.default = class_mask(default)
+        self.cameras = {camera: class_mask(names) for camera, names in (cameras or {}).items()}
+
+    @classmethod
+    def load(cls, path=None):
+        if not path:
+            return cls()
+        with open(path) as f:
+            rules = json.load(f)
+        return cls(rules.get("default", DEFAULT_REQUIRED), rules.get("cameras"))
+
+    def required(self, camera=None):
+        """Returns the required-class mask (len(PPE_CLASSES),) of a camera."""
+        return self.cameras.get(camera, self.default)
+
+
+@dataclass
+class Compliance:
+    """Per-person compliance of one or more frames: which required items each person misses."""
+
+    worn: np.ndarray  # (N, len(PPE_CLASSES)) bool, item detected on the person
+    missing: np.ndarray  # (N, len(PPE_CLASSES)) bool, required and not worn (False for unassessable persons)
+    assessable: np.ndarray  # (N,) bool
+    violation: np.ndarray  # (N,) bool, assessable and missing at least one required item
+
+
+def evaluate(required, assessable, ppe_parents, ppe_classes):
+    """Evaluates persons against required items from PPE already assigned to them.
+
+    `required` is a (len(PPE_CLASSES),) mask shared by all persons or an (N, len(PPE_CLASSES))
+    mask per person; PPE with parent -1 belongs to nobody. Everything is one array pass, so
+    many frames can be evaluated at once by concatenating them with offset parents.
+    """
+    assessable = np.asarray(assessable, dtype=bool)
+    ppe_parents = np.asarray(ppe_parents, dtype=int)
+    ppe_classes = np.asarray(ppe_classes, dtype=int)
+
+    worn = np.zeros((len(assessable), len(PPE_CLASSES)), dtype=bool)
+    # Class ids beyond PPE_CLASSES (labelled "PPE") can never be required, so they are ignored
+    owned = (ppe_parents >= 0) & (ppe_classes >= 0) & (ppe_classes < len(PPE_CLASSES))
+    worn[ppe_parents[owned], ppe_classes[owned]] = True
+
+    missing = np.asarray(required, dtype=bool) & ~worn & assessable[:, None]
+    return Compliance(worn, missing, assessable, missing.any(axis=1))
+
+
+def evaluate_result(result, required):
+    """Evaluates the persons of a DetectionResult (PPE already assigned by the pipeline)."""
+    return evaluate(required, result.person_assessable, result.ppe_parents, result.ppe_classes)
+
+
+def evaluate_boxes(required, person_boxes, ppe_boxes, ppe_classes, assessable=None):
+    """Evaluates persons against PPE boxes that are not assigned to anyone yet, e.g. the output
+    of the single-stage model or ground-truth annotations."""
+    if assessable is None:
+        assessable = np.ones(len(person_boxes), dtype=bool)
+    return evaluate(required, assessable, assign_to_persons(person_boxes, ppe_boxes), ppe_classes)
+
+
+def hour_of(timestamp):
+    """Returns the local-time hour bucket of a UNIX timestamp, e.g. 2026-10-18T14."""
+    return time.strftime("%Y-%m-%dT%H", time.localtime(timestamp))
+
+
+def read_mark(path, offset):
+    """Returns a fingerprint of the first `offset` bytes of a file: the SHA-1 of their first
+    and last CHECK_BYTES bytes."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        digest.update(f.read(min(offset, CHECK_BYTES)))
+        f.seek(max(offset - CHECK_BYTES, 0))
+        digest.update(f.read(min(offset, CHECK_BYTES)))
+    return digest.hexdigest()
+
+
+class JsonlTail:
+    """Yields the records of a JSONL file from byte `offset` on; afterwards `offset` is the end
+    of the last complete line, so a line still being written is read on the next call."""
+
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.offset = offset
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self.offset += len(line)
+                if line.strip():
+                    yield json.loads(line)
+
+
+def records_arrays(records):
+    """Flattens detection records into the arrays `evaluate` takes: (person_record, assessable,
+    ppe_parents, ppe_classes), with parents indexing the persons of all records together."""
+    person_record, assessable, ppe_parents, ppe_classes = [], [], [], []
+    for record_idx, record in enumerate(records):
+        for person in record["persons"]:
+            ppe_parents.extend([len(assessable)] * len(person["ppe"]))
+            ppe_classes.extend(item["class_id"] for item in person["ppe"])
+            person_record.append(record_idx)
+            assessable.append(person.get("assessable", True))
+    return (np.array(person_record, dtype=int), np.array(assessable, dtype=bool),
+            np.array(ppe_parents, dtype=int), np.array(ppe_classes, dtype=int))
+
+
+class ComplianceSummary:
+    """Running compliance counters per (camera, hour), small enough to keep for months of frames.
+
+    Frames are added as they are evaluated (or from records files, each record once), and the
+    reports by camera, hour, day or class are computed from these counters alone.
+    """
+
+    def __init__(self):
+        self.counts = {}  # (camera, hour) -> int64 array of SUMMARY_COLUMNS
+        self.sources = {}  # Records files already added -> what was read of them (see add_records)
+
+    def _row(self, key):
+        row = self.counts.get(key)
+        if row is None:
+            row = self.counts[key] = np.zeros(len(SUMMARY_COLUMNS), dtype=np.int64)
+        return row
+
+    def add(self, camera, hour, compliance):
+        """Adds the persons of one frame (or of several frames of the same camera and hour)."""
+        self._row((camera, hour))[:] += person_counts(compliance).sum(axis=0)
+
+    def add_grouped(self, keys, person_keys, compliance):
+        """Adds persons of many frames at once; person i is counted under keys[person_keys[i]]."""
+        totals = np.zeros((len(keys), len(SUMMARY_COLUMNS)), dtype=np.int64)
+        np.add.at(totals, person_keys, person_counts(compliance))
+        for key, total in zip(keys, totals):
+            self._row(key)[:] += total
+
+    def add_records(self, path, camera=None, rules=None, chunk_size=RECORD_CHUNK):
+        """Evaluates and adds the records of a file (JSONL or Parquet) not added before; returns
+        how many were added, or None when the file was rewritten since it was added.
+
+        JSONL files are read from where the previous call stopped, so records appended since
+        (e.g. by a running video_inference.py) are added and earlier ones are never counted
+        twice. A file whose already-added part changed, or a Parquet file that changed at all,
+        is refused with a warning: its earlier records are already in the summary.
+
+        Records without a "camera" are counted under `camera` (default: the file name) and
+        records without a "timestamp" under the hour the file was last modified.
+        """
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        source = self.sources.get(key)
+        is_parquet = path.endswith(".parquet")
+
+        if source is None:
+            offset = 0
+        elif is_parquet:
+            if source == {"size": stat.st_size, "mtime": stat.st_mtime}:
+                return 0
+            offset = None
+        else:
+            unchanged = stat.st_size >= source["offset"] and read_mark(path, source["offset"]) == source["mark"]
+            offset = source["offset"] if unchanged else None
+        if offset is None:
+            print(f"⚠️ {path} was rewritten since it was added to the summary; its earlier records are "
+                  f"already counted. Start a new summary or write to a new records file. Skipping...")
+            return None
+
+        rules = rules or ComplianceRules()
+        camera = camera or os.path.splitext(os.path.basename(path))[0]
+        records = iter_records(path) if is_parquet else JsonlTail(path, offset)
+
+        added = 0
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                added += self._add_chunk(chunk, camera, stat.st_mtime, rules)
+                chunk = []
+        added += self._add_chunk(chunk, camera, stat.st_mtime, rules)
+
+        if is_parquet:
+            self.sources[key] = {"size": stat.st_size, "mtime": stat.st_mtime}
+        else:
+            self.sources[key] = {"offset": records.offset, "mark": read_mark(path, records.offset)}
+        return added
+
+    def _add_chunk(self, records, camera, default_time, rules):
+        keys, record_keys = {}, []
+        for record in records:
+            key = (record.get("camera") or camera, hour_of(record.get("timestamp") or default_time))
+            record_keys.append(keys.setdefault(key, len(keys)))
+
+        person_record, assessable, ppe_parents, ppe_classes = records_arrays(records)
+        person_keys = np.array(record_keys, dtype=int)[person_record]
+        required = np.stack([rules.required(key_camera) for key_camera, _ in keys] or [rules.default])
+        compliance = evaluate(required[person_keys], assessable, ppe_parents, ppe_classes)
+        self.add_grouped(list(keys), person_keys, compliance)
+        return len(records)
+
+    def merge(self, other):
+        for key, row in other.counts.items():
+            self._row(key)[:] += row
+        self.sources.update(other.sources)
+
+    def report(self, by="camera"):
+        """Returns {group: counts} summed over camera, hour, day or all ("total")."""
+        groups = {}
+        for (camera, hour), row in self.counts.items():
+            group = {"camera": camera, "hour": hour, "day": hour[:10], "total": "total"}[by]
+            groups[group] = groups.get(group, 0) + row
+        return dict(sorted(groups.items()))
+
+    def class_report(self):
+        """Returns per PPE class: required-but-missing and worn counts over everything."""
+        total = sum(self.counts.values(), np.zeros(len(SUMMARY_COLUMNS), dtype=np.int64))
+        offset = len(TOTAL_COLUMNS)
+        return {name: {"missing": int(total[offset + idx]), "worn": int(total[offset + len(PPE_CLASSES) + idx])}
+                for idx, name in enumerate(PPE_CLASSES)}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        rows = [{"camera": camera, "hour": hour, "counts": row.tolist()}
+                for (camera, hour), row in sorted(self.counts.items())]
+        with open(path + ".tmp", "w") as f:
+            json.dump({"columns": SUMMARY_COLUMNS, "sources": self.sources, "rows": rows}, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a saved summary, or returns an empty one if `path` does not exist."""
+        summary = cls()
+        if not os.path.exists(path):
+            return summary
+        with open(path) as f:
+            data = json.load(f)
+        if data["columns"] != SUMMARY_COLUMNS:
+            raise ValueError(f"{path} was written for other PPE classes; start a new summary.")
+        summary.sources = data["sources"]
+        for row in data["rows"]:
+            summary.counts[(row["camera"], row["hour"])] = np.array(row["counts"], dtype=np.int64)
+        return summary
+
+
+def person_counts(compliance):
+    """Returns the (N, len(SUMMARY_COLUMNS)) counter contributions of each person."""
+    return np.concatenate([
+        np.ones((len(compliance.assessable), 1), dtype=np.int64),
+        compliance.assessable[:, None],
+        compliance.violation[:, None],
+        compliance.missing,
+        compliance.worn,
+    ], axis=1).astype(np.int64)
+
+
+def print_report(summary, by):
+    if by == "class":
+        print(f"{'class':<16}{'missing':>10}{'worn':>10}")
+        for name, counts in summary.class_report().items():
+            print(f"{name:<16}{counts['missing']:>10}{counts['worn']:>10}")
+        return
+
+    print(f"{by:<20}{'persons':>10}{'assessable':>12}{'violations':>12}{'rate':>8}")
+    for group, row in summary.report(by).items():
+        persons, assessable, violations = row[:len(TOTAL_COLUMNS)]
+        rate = violations / assessable if assessable else 0.0
+        print(f"{group:<20}{persons:>10}{assessable:>12}{violations:>12}{rate:>8.1%}")
+
+
+def main():
+    parser = ArgumentParser(description="Check PPE compliance of detection records and report running totals.")
+    parser.add_argument("--records", nargs="*", default=[], help="Detection records files (.jsonl or .parquet) to add.")
+    parser.add_argument("--summary", default=DEFAULT_SUMMARY, help="Running summary file to update and report from.")
+    parser.add_argument("--rules", help="JSON rules file with the required PPE per camera (default: hard-hat and vest).")
+    parser.add_argument("--camera", help="Camera of records without one (default: the records file name).")
+    parser.add_argument("--by", choices=["camera", "hour", "day", "class", "total"], default="camera",
+                        help="Grouping of the printed report.")
+    args = parser.parse_args()
+
+    summary = ComplianceSummary.load(args.summary)
+    rules = ComplianceRules.load(args.rules)
+    for path in args.records:
+        added = summary.add_records(path, camera=args.camera, rules=rules)
+        if added == 0:
+            print(f"⏭️ No new records in {path}.")
+        elif added:
+            print(f"✅ Added {added} new records from {path}")
+    if args.records:
+        summary.save(args.summary)
+
+    if not summary.counts:
+        print(f"❌ Error: {args.summary} has no records yet, pass --records!")
+        return
+    print_report(summary, args.by)
+
+
+if __name__ == "__main__":
+    main()
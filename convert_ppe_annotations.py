@@ -1,114 +1,237 @@
+import glob
+import hashlib
 import os
+import shutil
 import xml.etree.ElementTree as ET
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 import cv2
-from ultralytics import YOLO
-
-# Load person detection model
-person_model = YOLO("weights/person_detection.pt")
-
-# Input folders
-image_folder = "datasets/images"
-label_folder = "datasets/labels"
-
-# Output folders for cropped images and new labels
-cropped_image_folder = "datasets/cropped_persons/train"
-cropped_label_folder = "datasets/cropped_persons/train/labels"
-os.makedirs(cropped_image_folder, exist_ok=True)
-os.makedirs(cropped_label_folder, exist_ok=True)
-
-# Define PPE class names
-PPE_CLASSES = ["hard-hat", "gloves", "mask", "glasses", "boots", "vest", "ppe-suit", "ear-protector", "safety-harness"]
-
-def convert_ppe_annotations(image_name, full_img_width, full_img_height, person_x1, person_y1, person_x2, person_y2, objects):
-    """ Convert full-image PPE annotations to cropped-person coordinates """
-    new_annotations = []
-    
-    for obj in objects:
-        cls_name = obj.find("name").text
-        if cls_name not in PPE_CLASSES:
+import numpy as np
+from detection_cache import PERSON_CACHE_PATH, PersonDetectionCache
+from ppe_pipeline import PPE_CLASSES, PPEPipeline
+
+# Splits written under the output folder, each with images/ and labels/ as the dataset YAML expects
+SPLITS = ["train", "val"]
+VAL_FRACTION = 0.2
+
+# Class name -> YOLO class id lookup
+PPE_CLASS_IDS = {name: idx for idx, name in enumerate(PPE_CLASSES)}
+
+# YOLO label line: class id followed by the normalized box
+LABEL_FORMAT = "%d %.6f %.6f %.6f %.6f"
+
+def parse_ppe_objects(image_name, root):
+    """ Parse the PPE objects of an annotation once into an (N, 5) array of class_id, xmin, ymin, xmax, ymax """
+    rows = []
+    for obj in root.findall("object"):
+        cls_id = PPE_CLASS_IDS.get(obj.find("name").text)
+        if cls_id is None:
             continue  # Skip non-PPE objects
-        
-        cls_id = PPE_CLASSES.index(cls_name)
-        bbox = obj.find("bndbox")
 
+        bbox = obj.find("bndbox")
         try:
-            xmin = int(bbox.find("xmin").text)
-            ymin = int(bbox.find("ymin").text)
-            xmax = int(bbox.find("xmax").text)
-            ymax = int(bbox.find("ymax").text)
+            rows.append((cls_id, int(bbox.find("xmin").text), int(bbox.find("ymin").text),
+                         int(bbox.find("xmax").text), int(bbox.find("ymax").text)))
         except AttributeError:
             print(f"⚠️ Skipping object in {image_name} due to missing bounding box.")
             continue  # Skip if any bounding box data is missing
 
-        # Check if PPE is inside the cropped person bounding box
-        if xmax < person_x1 or xmin > person_x2 or ymax < person_y1 or ymin > person_y2:
-            continue
-
-        # Adjust coordinates relative to cropped person
-        new_xmin = max(xmin - person_x1, 0)
-        new_ymin = max(ymin - person_y1, 0)
-        new_xmax = min(xmax - person_x1, person_x2 - person_x1)
-        new_ymax = min(ymax - person_y1, person_y2 - person_y1)
-
-        # Normalize coordinates for YOLO format
-        x_center = (new_xmin + new_xmax) / 2 / (person_x2 - person_x1)
-        y_center = (new_ymin + new_ymax) / 2 / (person_y2 - person_y1)
-        width = (new_xmax - new_xmin) / (person_x2 - person_x1)
-        height = (new_ymax - new_ymin) / (person_y2 - person_y1)
-
-        new_annotations.append(f"{cls_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}")
-
-    return new_annotations
-
-def process_images():
-    """ Process each image and extract cropped persons with adjusted PPE annotations """
-    for image_name in os.listdir(image_folder):
+    return np.array(rows, dtype=np.int64).reshape(-1, 5)
+
+def convert_ppe_annotations(objects, person_boxes):
+    """ Convert full-image PPE annotations to cropped-person YOLO labels for all persons at once.
+
+    Returns a (P, N) mask of which objects touch each person box and a (P, N, 4) array of the
+    objects' normalized x_center, y_center, width, height relative to each person crop.
+    """
+    persons = np.asarray(person_boxes, dtype=np.int64).reshape(-1, 4)[:, None, :]  # (P, 1, 4)
+    px1, py1, px2, py2 = (persons[..., k] for k in range(4))
+    xmin, ymin, xmax, ymax = (objects[None, :, k] for k in range(1, 5))  # (1, N)
+
+    crop_w = px2 - px1
+    crop_h = py2 - py1
+
+    # Check if PPE is inside the cropped person bounding box
+    inside = ~((xmax < px1) | (xmin > px2) | (ymax < py1) | (ymin > py2))
+    inside &= (crop_w > 0) & (crop_h > 0)
+
+    # Adjust coordinates relative to cropped person
+    new_xmin = np.maximum(xmin - px1, 0)
+    new_ymin = np.maximum(ymin - py1, 0)
+    new_xmax = np.minimum(xmax - px1, crop_w)
+    new_ymax = np.minimum(ymax - py1, crop_h)
+
+    # Normalize coordinates for YOLO format
+    with np.errstate(divide="ignore", invalid="ignore"):
+        labels = np.stack([
+            (new_xmin + new_xmax) / 2 / crop_w,
+            (new_ymin + new_ymax) / 2 / crop_h,
+            (new_xmax - new_xmin) / crop_w,
+            (new_ymax - new_ymin) / crop_h,
+        ], axis=-1)
+
+    return inside, labels
+
+def split_for(image_name, val_fraction=VAL_FRACTION):
+    """Assigns a source image to train or val by a stable hash of its name, so every crop of
+    one photo lands in the same split on every machine and every rebuild."""
+    stem = os.path.splitext(image_name)[0]
+    bucket = int(hashlib.sha1(stem.encode()).hexdigest()[:8], 16) / 0x100000000
+    return "val" if bucket < val_fraction else "train"
+
+# Per-process state of the worker pool
+_pipeline = None
+_person_cache = None
+_torch_threads = None
+
+def _init_worker(cache_path, threads_per_process):
+    global _pipeline, _person_cache, _torch_threads
+    _pipeline = PPEPipeline()
+    _person_cache = PersonDetectionCache(cache_path, weights=_pipeline.person_weights,
+                                         settings=_pipeline.person_settings)
+    _torch_threads = threads_per_process
+
+def _detect_persons(image):
+    """ Run the person model in a worker; the first miss caps its torch threads like inference.py does """
+    global _torch_threads
+    if _torch_threads:
+        # Imported only on a miss, so fully cached rebuilds never load torch
+        import torch
+        torch.set_num_threads(_torch_threads)
+        _torch_threads = None
+    return _pipeline.detect_persons(image, filtered=False)
+
+def convert_image(job):
+    """ Crop the persons of one source image and write their PPE labels into its split.
+
+    Returns (image name, crops written, labels written, new person detection or None); new
+    detections are stored in the cache by the parent process, the only writer.
+    """
+    image_path, label_path, split_folder = job
+    image_name = os.path.basename(image_path)
+    stem = os.path.splitext(image_name)[0]
+
+    # Parse the PPE objects once for all persons in the image
+    objects = parse_ppe_objects(image_name, ET.parse(label_path).getroot())
+
+    # Load image and look up its persons in the cache, running the model only on a miss
+    with open(image_path, "rb") as f:
+        data = f.read()
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        print(f"⚠️ Could not read {image_path}. Skipping...")
+        return image_name, 0, 0, None
+    image_hash = hashlib.sha1(data).hexdigest()
+    cached = _person_cache.get(image_hash)
+    if cached is None:
+        person_boxes, person_scores = _detect_persons(image)
+        detection = (image_hash, person_boxes, person_scores)
+    else:
+        person_boxes, person_scores = cached
+        detection = None
+
+    # Same confidence threshold, padding and size filter as the pipeline applies at inference
+    person_boxes, person_scores = _pipeline.filter_persons(person_boxes, person_scores)
+    crop_boxes, assessable = _pipeline.crop_boxes(image.shape, person_boxes)
+    crop_boxes = crop_boxes[assessable]
+
+    # Convert PPE annotations to cropped person coordinates for every person at once
+    inside, labels = convert_ppe_annotations(objects, crop_boxes)
+
+    written_labels = 0
+    for i, crop_box in enumerate(crop_boxes):
+        x1, y1, x2, y2 = map(int, crop_box)
+        name = f"{stem}_person_{i}"
+        cv2.imwrite(os.path.join(split_folder, "images", name + ".jpg"), image[y1:y2, x1:x2])
+
+        rows = np.column_stack([objects[inside[i], 0], labels[i][inside[i]]])
+        if len(rows):
+            np.savetxt(os.path.join(split_folder, "labels", name + ".txt"), rows, fmt=LABEL_FORMAT)
+            written_labels += 1
+
+    return image_name, len(crop_boxes), written_labels, detection
+
+def prepare_output(output_folder):
+    """ Empty the split folders (and stale label caches and packs) so removed crops never linger """
+    for split in SPLITS:
+        split_folder = os.path.join(output_folder, split)
+        for stale in ["images", "labels", "labels.cache", *glob.glob(os.path.join(split_folder, "packed_*"))]:
+            path = os.path.join(split_folder, stale)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        os.makedirs(os.path.join(split_folder, "images"))
+        os.makedirs(os.path.join(split_folder, "labels"))
+
+def write_dataset_yaml(output_folder, yaml_path):
+    """ Write the dataset YAML with split paths relative to the YAML's own folder """
+    relative = os.path.relpath(output_folder, os.path.dirname(os.path.abspath(yaml_path)))
+    with open(yaml_path, "w") as f:
+        for split in SPLITS:
+            f.write(f"{split}: {os.path.join(relative, split, 'images').replace(os.sep, '/')}\n")
+        f.write(f"nc: {len(PPE_CLASSES)}\n")
+        f.write(f"names: {PPE_CLASSES}\n")
+
+def process_images(image_folder, label_folder, output_folder, val_fraction=VAL_FRACTION, workers=None,
+                   cache_path=PERSON_CACHE_PATH):
+    """ Crop persons of every annotated image into train/val splits with adjusted PPE annotations """
+    jobs = []
+    for image_name in sorted(os.listdir(image_folder)):
         if not image_name.endswith(".jpg") and not image_name.endswith(".png"):
             continue
 
-        image_path = os.path.join(image_folder, image_name)
-        label_path = os.path.join(label_folder, image_name.replace(".jpg", ".xml"))
-
+        label_path = os.path.join(label_folder, os.path.splitext(image_name)[0] + ".xml")
         if not os.path.exists(label_path):
             print(f"⚠️ Warning: No XML annotation found for {image_name}. Skipping.")
             continue
 
-        # Load image and annotation
-        image = cv2.imread(image_path)
-        tree = ET.parse(label_path)
-        root = tree.getroot()
-
-        full_img_width = int(root.find("size/width").text)
-        full_img_height = int(root.find("size/height").text)
-
-        # Detect persons in the image
-        results = person_model(image)
-
-        if len(results[0].boxes.xyxy) == 0:
-            print(f"⚠️ No person detected in {image_name}, skipping.")
-            continue
-
-        for i, person_box in enumerate(results[0].boxes.xyxy.cpu().numpy()):
-            person_x1, person_y1, person_x2, person_y2 = map(int, person_box)
-
-            # Crop person from the image
-            cropped_image = image[person_y1:person_y2, person_x1:person_x2]
-            cropped_image_path = os.path.join(cropped_image_folder, f"{image_name.replace('.jpg', '')}_person_{i}.jpg")
-            cv2.imwrite(cropped_image_path, cropped_image)
-
-            # Convert PPE annotations to cropped person coordinates
-            objects = root.findall("object")
-            new_annotations = convert_ppe_annotations(image_name, full_img_width, full_img_height, person_x1, person_y1, person_x2, person_y2, objects)
-
-            # Save the new annotations
-            if new_annotations:
-                cropped_label_path = os.path.join(cropped_label_folder, f"{image_name.replace('.jpg', '')}_person_{i}.txt")
-                with open(cropped_label_path, "w") as f:
-                    f.write("\n".join(new_annotations))
-                print(f"✅ Saved {cropped_label_path} with {len(new_annotations)} annotations.")
+        split_folder = os.path.join(output_folder, split_for(image_name, val_fraction))
+        jobs.append((os.path.join(image_folder, image_name), label_path, split_folder))
+
+    prepare_output(output_folder)
+    print(f"🔄 Converting {len(jobs)} annotated images...")
+
+    crops = {split: 0 for split in SPLITS}
+    labelled = 0
+    pipeline = PPEPipeline()
+    workers = max(workers or os.cpu_count() or 1, 1)
+    # Workers that miss the cache each run the person model; split the cores between them
+    threads_per_process = max(1, (os.cpu_count() or 1) // workers)
+    with PersonDetectionCache(cache_path, weights=pipeline.person_weights,
+                              settings=pipeline.person_settings) as person_cache, \
+            ProcessPoolExecutor(workers, initializer=_init_worker,
+                                initargs=(cache_path, threads_per_process)) as pool:
+        for (_, _, split_folder), (image_name, num_crops, num_labels, detection) in zip(
+                jobs, pool.map(convert_image, jobs, chunksize=8)):
+            if detection is None:
+                person_cache.hits += 1
             else:
-                print(f"⚠️ No PPE annotations found for {cropped_image_path}. Skipping label creation.")
-
-# Run the process
-process_images()
-print("✅ All persons cropped and PPE annotations converted.")
+                person_cache.misses += 1
+                person_cache.put(*detection)
+            if num_crops == 0:
+                print(f"⚠️ No assessable person detected in {image_name}, skipping.")
+            crops[os.path.basename(split_folder)] += num_crops
+            labelled += num_labels
+
+    print(f"📦 Person detection cache: {person_cache.hits} hits, {person_cache.misses} misses")
+    print(f"✅ {sum(crops.values())} person crops ({crops['train']} train, {crops['val']} val), "
+          f"{labelled} with PPE annotations.")
+    return crops
+
+def main():
+    parser = ArgumentParser(description="Crop persons and convert PPE annotations into a train/val YOLO dataset.")
+    parser.add_argument("--images", default="datasets/images", help="Folder with the full images.")
+    parser.add_argument("--labels", default="datasets/labels", help="Folder with the PascalVOC XML annotations.")
+    parser.add_argument("--output", default="datasets/cropped_persons", help="Dataset folder to (re)build.")
+    parser.add_argument("--data", default="datasets/ppe_dataset.yaml", help="Dataset YAML to write.")
+    parser.add_argument("--val-fraction", type=float, default=VAL_FRACTION, help="Share of source images used for val.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of converter processes.")
+    args = parser.parse_args()
+
+    process_images(args.images, args.labels, args.output, args.val_fraction, args.workers)
+    write_dataset_yaml(args.output, args.data)
+    print(f"✅ All persons cropped and PPE annotations converted. Dataset YAML: {args.data}")
+
+if __name__ == "__main__":
+    main()
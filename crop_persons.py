@@ -1,9 +1,13 @@
 import cv2
 import os
-from ultralytics import YOLO
+from detection_cache import PersonDetectionCache
+from ppe_pipeline import PPEPipeline
 
-# Load trained person detection model
-person_model = YOLO("weights/person_detection.pt")
+# Person -> PPE detection pipeline (only the person model is used here)
+pipeline = PPEPipeline()
+
+# Person detections are cached on disk so re-running only infers new or changed images
+person_cache = PersonDetectionCache(weights=pipeline.person_weights, settings=pipeline.person_settings)
 
 # Input and output directories
 input_folder = "datasets/images"
@@ -12,10 +16,13 @@ output_folder = "datasets/cropped_persons"
 os.makedirs(output_folder, exist_ok=True)
 
 def crop_persons(image_path, output_folder):
-    image = cv2.imread(image_path)
-    results = person_model(image)
+    image, person_boxes, person_scores = person_cache.detect_persons(pipeline, image_path)
+
+    # Crop exactly what the pipeline would send to the PPE model
+    person_boxes, _ = pipeline.filter_persons(person_boxes, person_scores)
+    crop_boxes, assessable = pipeline.crop_boxes(image.shape, person_boxes)
 
-    for i, r in enumerate(results[0].boxes.xyxy):
+    for i, r in enumerate(crop_boxes[assessable]):
         x1, y1, x2, y2 = map(int, r)
         person_crop = image[y1:y2, x1:x2]
         cv2.imwrite(f"{output_folder}/cropped_{i}.jpg", person_crop)
@@ -25,4 +32,6 @@ for img_file in os.listdir(input_folder):
     if img_file.endswith(".jpg") or img_file.endswith(".png"):
         crop_persons(os.path.join(input_folder, img_file), output_folder)
 
+person_cache.close()
+print(f"📦 Person detection cache: {person_cache.hits} hits, {person_cache.misses} misses")
 print("✅ Cropped person images saved in datasets/cropped_persons")
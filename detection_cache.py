@@ -0,0 +1,106 @@
+import hashlib
+import os
+import sqlite3
+import cv2
+import numpy as np
+from metrics import METRICS
+from ppe_pipeline import PERSON_WEIGHTS, content_key
+
+# Default on-disk cache shared by crop_persons.py and convert_ppe_annotations.py
+PERSON_CACHE_PATH = "datasets/person_detections.sqlite"
+
+# Pending inserts are committed in batches of this size
+COMMIT_EVERY = 256
+
+
+def file_hash(path):
+    """Returns the SHA-1 of a file's contents, or of all files in a model directory, read in chunks."""
+    digest = hashlib.sha1()
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        paths = [path]
+    for file_path in paths:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PersonDetectionCache:
+    """SQLite store of person detections keyed by image content hash and person-weights hash.
+
+    Boxes are stored as a packed float32 (N, 5) blob of x1, y1, x2, y2, score, so retraining
+    the person model (new weights) or editing an image automatically invalidates its entry.
+    `settings` that change how the model is run (PPEPipeline.person_settings) are hashed in too.
+    """
+
+    def __init__(self, path=PERSON_CACHE_PATH, weights=PERSON_WEIGHTS, settings=None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.weights_hash = file_hash(weights)
+        if settings:
+            self.weights_hash = content_key(self.weights_hash.encode(), settings)
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS person_detections ("
+            " image_hash TEXT NOT NULL, weights_hash TEXT NOT NULL, boxes BLOB NOT NULL,"
+            " PRIMARY KEY (image_hash, weights_hash))"
+        )
+
+    def get(self, image_hash):
+        """Returns cached (boxes, scores) for an image hash, or None on a miss."""
+        row = self._conn.execute(
+            "SELECT boxes FROM person_detections WHERE image_hash = ? AND weights_hash = ?",
+            (image_hash, self.weights_hash),
+        ).fetchone()
+        if row is None:
+            return None
+        packed = np.frombuffer(row[0], dtype=np.float32).reshape(-1, 5)
+        return packed[:, :4], packed[:, 4]
+
+    def put(self, image_hash, boxes, scores):
+        packed = np.column_stack([np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+                                  np.asarray(scores, dtype=np.float32)])
+        self._conn.execute(
+            "INSERT OR REPLACE INTO person_detections VALUES (?, ?, ?)",
+            (image_hash, self.weights_hash, packed.tobytes()),
+        )
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self._conn.commit()
+            self._pending = 0
+
+    def detect_persons(self, pipeline, image_path):
+        """Returns (image, boxes, scores) for an image file, running the person model only on a miss."""
+        with open(image_path, "rb") as f:
+            data = f.read()
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        image_hash = hashlib.sha1(data).hexdigest()
+
+        cached = self.get(image_hash)
+        METRICS.inc("ppe_cache_requests_total", cache="person_detections", result="miss" if cached is None else "hit")
+        if cached is not None:
+            self.hits += 1
+            return image, cached[0], cached[1]
+
+        self.misses += 1
+        # Unfiltered, so changing the pipeline's confidence threshold never needs new entries
+        boxes, scores = pipeline.detect_persons(image, filtered=False)
+        self.put(image_hash, boxes, scores)
+        return image, boxes, scores
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,127 @@
+import json
+import os
+from ppe_pipeline import ppe_label
+
+# Default number of image records buffered per Parquet row group
+PARQUET_BATCH_SIZE = 1024
+
+
+def _box(box):
+    return [round(float(v), 1) for v in box]
+
+
+def detection_record(image_id, result, track_ids=None):
+    """Builds the JSON-serializable record of one image: each person with the PPE found on it."""
+    persons = []
+    for idx, (box, score) in enumerate(zip(result.person_boxes, result.person_scores)):
+        mask = result.ppe_for_person(idx)
+        persons.append({
+            "track_id": int(track_ids[idx]) if track_ids is not None else None,
+            "box": _box(box),
+            "score": round(float(score), 4),
+            "assessable": bool(result.person_assessable[idx]),
+            "ppe": [
+                {"class_id": int(class_id), "label": ppe_label(int(class_id)),
+                 "box": _box(ppe_box), "score": round(float(ppe_score), 4)}
+                for ppe_box, class_id, ppe_score in zip(result.ppe_boxes[mask], result.ppe_classes[mask],
+                                                        result.ppe_scores[mask])
+            ],
+        })
+    return {"image_id": str(image_id), "persons": persons}
+
+
+class JsonlWriter:
+    """Appends one detection record per line, flushing each line as it is written, so nothing
+    accumulates in memory and a crashed run keeps every record written before it."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        # Line buffered: every complete record reaches the file at once
+        self._file = open(path, "w", buffering=1)
+
+    def write_record(self, record):
+        self._file.write(json.dumps(record) + "\n")
+
+    def write(self, image_id, result, track_ids=None):
+        self.write_record(detection_record(image_id, result, track_ids))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _parquet_schema(pa):
+    box = pa.list_(pa.float32(), 4)
+    ppe = pa.struct([("class_id", pa.int32()), ("label", pa.string()), ("box", box), ("score", pa.float32())])
+    person = pa.struct([("track_id", pa.int64()), ("box", box), ("score", pa.float32()),
+                         ("assessable", pa.bool_()), ("ppe", pa.list_(ppe))])
+    return pa.schema([("image_id", pa.string()), ("persons", pa.list_(person))])
+
+
+class ParquetWriter:
+    """Writes detection records to Parquet in row groups of `batch_size` images (needs pyarrow)."""
+
+    def __init__(self, path, batch_size=PARQUET_BATCH_SIZE):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet output requires pyarrow: pip install pyarrow") from e
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self._pa = pa
+        self._schema = _parquet_schema(pa)
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._buffer = []
+
+    def write_record(self, record):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def write(self, image_id, result, track_ids=None):
+        self.write_record(detection_record(image_id, result, track_ids))
+
+    def flush(self):
+        if self._buffer:
+            self._writer.write_table(self._pa.Table.from_pylist(self._buffer, schema=self._schema))
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_writer(path, **kwargs):
+    """Returns a Parquet writer for `.parquet` paths and a JSONL writer otherwise."""
+    if path.endswith(".parquet"):
+        return ParquetWriter(path, **kwargs)
+    return JsonlWriter(path)
+
+
+def iter_records(path):
+    """Yields detection records back from a JSONL or Parquet file, one image at a time."""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches():
+            yield from batch.to_pylist()
+    else:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
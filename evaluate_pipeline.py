@@ -0,0 +1,321 @@
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from argparse import ArgumentParser
+from itertools import product
+import cv2
+import numpy as np
+from ppe_pipeline import DEFAULT_ROUTE, JOINT_CLASSES, PPE_CLASSES, ROUTES, PPEPipeline, box_iou, content_key
+
+# Predictions are cached with loose model thresholds, so every stricter setting can be
+# re-scored from them: confidences down to CACHE_CONF, NMS IoU up to CACHE_IOU
+CACHE_CONF = 0.01
+CACHE_IOU = 0.9
+DEFAULT_CACHE = "results/eval_predictions.npz"
+
+# Settings swept by default; 0.25 / 0.7 are the Ultralytics defaults the pipeline runs with
+CONF_SWEEP = [0.1, 0.25, 0.4, 0.55]
+IOU_SWEEP = [0.5, 0.7]
+
+# IoU thresholds averaged by mAP50-95; the first one (0.5) gives precision, recall and mAP50
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+# Joint class ids (person 0, PPE class k is k + 1) by annotation name
+CLASS_IDS = {name: idx for idx, name in enumerate(JOINT_CLASSES)}
+
+
+def load_ground_truth(label_folder, image_folder):
+    """Reads every PascalVOC XML of `label_folder` whose image exists in `image_folder`.
+
+    Returns the image paths and the (image, class, box) arrays of all their objects, with
+    joint class ids (person plus PPE) in full-image coordinates.
+    """
+    image_paths, gt_image, gt_class, gt_boxes = [], [], [], []
+    for xml_name in sorted(os.listdir(label_folder)):
+        if not xml_name.endswith(".xml"):
+            continue
+        root = ET.parse(os.path.join(label_folder, xml_name)).getroot()
+        image_path = os.path.join(image_folder, root.find("filename").text)
+        if not os.path.exists(image_path):
+            print(f"⚠️ Image {image_path} for {xml_name} not found. Skipping...")
+            continue
+
+        for obj in root.findall("object"):
+            class_id = CLASS_IDS.get(obj.find("name").text)
+            bbox = obj.find("bndbox")
+            if class_id is None or bbox is None:
+                continue
+            gt_image.append(len(image_paths))
+            gt_class.append(class_id)
+            gt_boxes.append([float(bbox.find(key).text) for key in ["xmin", "ymin", "xmax", "ymax"]])
+        image_paths.append(image_path)
+
+    return image_paths, (np.array(gt_image, dtype=int), np.array(gt_class, dtype=int),
+                         np.array(gt_boxes, dtype=np.float32).reshape(-1, 4))
+
+
+def cache_key(pipeline, image_paths):
+    """Identifies a prediction cache by the images, the pipeline settings and the weights' mtimes."""
+    weights = [pipeline.person_weights, pipeline.ppe_weights, pipeline.joint_weights]
+    stamps = {path: os.path.getmtime(path) for path in weights if os.path.exists(path)}
+    return content_key("\n".join(image_paths).encode(), {**pipeline.settings, "weights_mtime": stamps})
+
+
+def run_predictions(pipeline, image_paths):
+    """Runs the pipeline once over the images and flattens the results into arrays; PPE rows
+    point at their person by its index among all persons."""
+    persons = {"image": [], "boxes": [], "scores": [], "assessable": []}
+    ppe = {"person": [], "boxes": [], "classes": [], "scores": []}
+    num_persons = 0
+    start = time.perf_counter()
+    for image_idx, image_path in enumerate(image_paths):
+        image = cv2.imread(image_path)
+        if image is None:
+            print(f"⚠️ Could not read {image_path}. Skipping...")
+            continue
+        result = pipeline.detect(image)
+
+        persons["image"].append(np.full(len(result.person_boxes), image_idx))
+        persons["boxes"].append(result.person_boxes)
+        persons["scores"].append(result.person_scores)
+        persons["assessable"].append(result.person_assessable)
+        ppe["person"].append(result.ppe_parents + num_persons)
+        ppe["boxes"].append(result.ppe_boxes)
+        ppe["classes"].append(result.ppe_classes)
+        ppe["scores"].append(result.ppe_scores)
+        num_persons += len(result.person_boxes)
+
+        if (image_idx + 1) % 100 == 0:
+            print(f"🔄 {image_idx + 1}/{len(image_paths)} images")
+
+    def stack(values, dtype, width=None):
+        array = np.concatenate(values).astype(dtype) if values else np.zeros(0, dtype)
+        return array.reshape(-1, width) if width else array
+
+    return {
+        "person_image": stack(persons["image"], int),
+        "person_boxes": stack(persons["boxes"], np.float32, 4),
+        "person_scores": stack(persons["scores"], np.float32),
+        "person_assessable": stack(persons["assessable"], bool),
+        "ppe_person": stack(ppe["person"], int),
+        "ppe_boxes": stack(ppe["boxes"], np.float32, 4),
+        "ppe_classes": stack(ppe["classes"], int),
+        "ppe_scores": stack(ppe["scores"], np.float32),
+        "seconds_per_image": np.float64((time.perf_counter() - start) / max(len(image_paths), 1)),
+    }
+
+
+def load_predictions(cache_path, pipeline, image_paths, refresh=False):
+    """Returns the cached predictions for these images and settings, running the pipeline only
+    when the cache is missing or stale."""
+    key = cache_key(pipeline, image_paths)
+    if not refresh and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            if str(cached["key"]) == key:
+                print(f"✅ Using cached predictions from {cache_path}")
+                return {name: cached[name] for name in cached.files if name != "key"}
+
+    print(f"🔄 Running the pipeline on {len(image_paths)} images (cached in {cache_path})...")
+    predictions = run_predictions(pipeline, image_paths)
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    np.savez(cache_path, key=key, **predictions)
+    return predictions
+
+
+def grouped_nms(boxes, scores, groups, iou_threshold):
+    """Greedy NMS within each group (e.g. image, or person and class); returns the kept indices."""
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=int)
+    order = np.lexsort((-scores, groups))
+    splits = np.flatnonzero(np.diff(groups[order])) + 1
+
+    kept = []
+    for members in np.split(order, splits):
+        if len(members) == 1:
+            kept.append(members)
+            continue
+        iou = box_iou(boxes[members], boxes[members])
+        keep = np.ones(len(members), dtype=bool)
+        for i in range(len(members)):
+            if keep[i]:
+                keep[i + 1:] &= iou[i, i + 1:] < iou_threshold
+        kept.append(members[keep])
+    return np.sort(np.concatenate(kept))
+
+
+def apply_thresholds(predictions, person_conf, ppe_conf, iou_threshold):
+    """Re-derives what the pipeline would output with stricter thresholds from cached predictions.
+
+    Persons below `person_conf` are dropped along with their PPE (the pipeline would not have
+    cropped them), then NMS runs per image for persons and per person and class for PPE.
+    Returns the flattened (image, joint class, box, score) predictions and the number of PPE
+    crops (assessable persons) the setting would run.
+    """
+    person_scores = predictions["person_scores"]
+    candidates = np.flatnonzero(person_scores >= person_conf)
+    kept = candidates[grouped_nms(predictions["person_boxes"][candidates], person_scores[candidates],
+                                  predictions["person_image"][candidates], iou_threshold)]
+    person_kept = np.zeros(len(person_scores), dtype=bool)
+    person_kept[kept] = True
+
+    ppe_person, ppe_classes, ppe_scores = predictions["ppe_person"], predictions["ppe_classes"], predictions["ppe_scores"]
+    candidates = np.flatnonzero((ppe_scores >= ppe_conf) & person_kept[ppe_person])
+    ppe_kept = candidates[grouped_nms(predictions["ppe_boxes"][candidates], ppe_scores[candidates],
+                                      ppe_person[candidates] * len(PPE_CLASSES) + ppe_classes[candidates],
+                                      iou_threshold)]
+
+    pred_image = np.concatenate([predictions["person_image"][kept], predictions["person_image"][ppe_person[ppe_kept]]])
+    pred_class = np.concatenate([np.zeros(len(kept), dtype=int), ppe_classes[ppe_kept] + 1])
+    pred_boxes = np.concatenate([predictions["person_boxes"][kept], predictions["ppe_boxes"][ppe_kept]])
+    pred_scores = np.concatenate([person_scores[kept], ppe_scores[ppe_kept]])
+    crops = int(predictions["person_assessable"][kept].sum())
+    return (pred_image, pred_class, pred_boxes, pred_scores), crops
+
+
+def match_predictions(gt, preds, num_images):
+    """Marks each prediction as a true positive at every IoU threshold: (P, len(IOU_THRESHOLDS)).
+
+    Per image, one IoU matrix between all ground truth and predictions (zeroed across classes)
+    is matched greedily by IoU, each box used at most once, for all thresholds at once.
+    """
+    gt_image, gt_class, gt_boxes = gt
+    pred_image, pred_class, pred_boxes, _ = preds
+    tp = np.zeros((len(pred_image), len(IOU_THRESHOLDS)), dtype=bool)
+
+    gt_order, pred_order = np.argsort(gt_image, kind="stable"), np.argsort(pred_image, kind="stable")
+    gt_bounds = np.searchsorted(gt_image[gt_order], np.arange(num_images + 1))
+    pred_bounds = np.searchsorted(pred_image[pred_order], np.arange(num_images + 1))
+    for image_idx in range(num_images):
+        g = gt_order[gt_bounds[image_idx]:gt_bounds[image_idx + 1]]
+        p = pred_order[pred_bounds[image_idx]:pred_bounds[image_idx + 1]]
+        if len(g) == 0 or len(p) == 0:
+            continue
+        iou = box_iou(gt_boxes[g], pred_boxes[p]) * (gt_class[g, None] == pred_class[None, p])
+
+        for t, threshold in enumerate(IOU_THRESHOLDS):
+            gi, pi = np.nonzero(iou >= threshold)
+            if len(gi) == 0:
+                break  # Higher thresholds cannot match either
+            order = np.argsort(-iou[gi, pi], kind="stable")
+            gi, pi = gi[order], pi[order]
+            first = np.sort(np.unique(pi, return_index=True)[1])  # Best ground truth per prediction
+            gi, pi = gi[first], pi[first]
+            first = np.unique(gi, return_index=True)[1]  # Best prediction per ground truth
+            tp[p[pi[first]], t] = True
+    return tp
+
+
+def average_precision(recall, precision):
+    """COCO-style 101-point interpolated AP of a precision/recall curve ordered by confidence."""
+    recall = np.concatenate([[0.0], recall, [1.0]])
+    precision = np.concatenate([[1.0], precision, [0.0]])
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    points = np.searchsorted(recall, np.linspace(0, 1, 101), side="left")
+    return precision[np.minimum(points, len(precision) - 1)].mean()
+
+
+def class_metrics(gt, preds, tp):
+    """Returns per joint class: ground truth and prediction counts, precision and recall at
+    IoU 0.5, AP50 and AP50-95."""
+    gt_class = gt[1]
+    _, pred_class, _, pred_scores = preds
+    order = np.argsort(-pred_scores, kind="stable")
+    pred_class, tp = pred_class[order], tp[order]
+
+    metrics = {}
+    for class_id, name in enumerate(JOINT_CLASSES):
+        class_tp = tp[pred_class == class_id]
+        num_gt, num_pred = int((gt_class == class_id).sum()), len(class_tp)
+        if num_gt == 0 and num_pred == 0:
+            continue
+        tp_cum = np.cumsum(class_tp, axis=0)
+        recall = tp_cum / max(num_gt, 1)
+        precision = tp_cum / np.arange(1, num_pred + 1)[:, None]
+        ap = np.array([average_precision(recall[:, t], precision[:, t]) if num_gt and num_pred else 0.0
+                       for t in range(len(IOU_THRESHOLDS))])
+        true_positives = int(tp_cum[-1, 0]) if num_pred else 0
+        metrics[name] = {
+            "gt": num_gt,
+            "pred": num_pred,
+            "precision": true_positives / num_pred if num_pred else 0.0,
+            "recall": true_positives / num_gt if num_gt else 0.0,
+            "ap50": float(ap[0]),
+            "ap50_95": float(ap.mean()),
+        }
+    return metrics
+
+
+def summarize(metrics):
+    """Means of the per-class metrics over the classes that have ground truth."""
+    rows = [row for row in metrics.values() if row["gt"]]
+    return {key: float(np.mean([row[key] for row in rows])) if rows else 0.0
+            for key in ["precision", "recall", "ap50", "ap50_95"]}
+
+
+def evaluate(gt, predictions, num_images, person_conf, ppe_conf, iou_threshold):
+    """Scores one threshold setting from the cached predictions."""
+    preds, crops = apply_thresholds(predictions, person_conf, ppe_conf, iou_threshold)
+    metrics = class_metrics(gt, preds, match_predictions(gt, preds, num_images))
+    return {"person_conf": person_conf, "ppe_conf": ppe_conf, "iou": iou_threshold,
+            "crops_per_image": crops / max(num_images, 1), **summarize(metrics), "classes": metrics}
+
+
+def print_sweep(rows):
+    print(f"{'person_conf':>12}{'ppe_conf':>10}{'iou':>6}{'P':>8}{'R':>8}{'mAP50':>8}{'mAP50-95':>10}{'crops/img':>11}")
+    for row in rows:
+        print(f"{row['person_conf']:>12.2f}{row['ppe_conf']:>10.2f}{row['iou']:>6.2f}{row['precision']:>8.3f}"
+              f"{row['recall']:>8.3f}{row['ap50']:>8.3f}{row['ap50_95']:>10.3f}{row['crops_per_image']:>11.2f}")
+
+
+def print_classes(row):
+    print(f"📊 Per class at person_conf {row['person_conf']}, ppe_conf {row['ppe_conf']}, iou {row['iou']}")
+    print(f"{'class':<16}{'gt':>6}{'pred':>7}{'P':>8}{'R':>8}{'AP50':>8}{'AP50-95':>9}")
+    for name, metrics in row["classes"].items():
+        print(f"{name:<16}{metrics['gt']:>6}{metrics['pred']:>7}{metrics['precision']:>8.3f}{metrics['recall']:>8.3f}"
+              f"{metrics['ap50']:>8.3f}{metrics['ap50_95']:>9.3f}")
+
+
+def main():
+    parser = ArgumentParser(description="Evaluate the full person -> PPE pipeline against the XML ground truth.")
+    parser.add_argument("--images", default="datasets/images", help="Folder with the annotated images.")
+    parser.add_argument("--labels", default="datasets/labels", help="Folder with the PascalVOC XML annotations.")
+    parser.add_argument("--route", choices=ROUTES, default=DEFAULT_ROUTE, help="Pipeline route to evaluate.")
+    parser.add_argument("--cache", default=DEFAULT_CACHE, help="Prediction cache; reused while images and settings match.")
+    parser.add_argument("--refresh", action="store_true", help="Re-run the pipeline even if the cache is valid.")
+    parser.add_argument("--person-conf", type=float, nargs="+", default=CONF_SWEEP, help="Person confidences to sweep.")
+    parser.add_argument("--ppe-conf", type=float, nargs="+", default=CONF_SWEEP, help="PPE confidences to sweep.")
+    parser.add_argument("--iou", type=float, nargs="+", default=IOU_SWEEP, help="NMS IoU thresholds to sweep.")
+    parser.add_argument("--output", default="results/evaluation.json", help="JSON file with every setting's metrics.")
+    args = parser.parse_args()
+
+    if min(args.person_conf + args.ppe_conf) < CACHE_CONF or max(args.iou) > CACHE_IOU:
+        print(f"❌ Error: Sweeps must stay within conf >= {CACHE_CONF} and iou <= {CACHE_IOU} of the cache!")
+        return
+
+    image_paths, gt = load_ground_truth(args.labels, args.images)
+    if not image_paths:
+        print(f"❌ Error: No annotated images found in {args.labels}!")
+        return
+
+    # Every person gets its PPE pass at cache time; person thresholds are applied when re-scoring
+    pipeline = PPEPipeline(route=args.route, min_person_conf=0.0, model_conf=CACHE_CONF, model_iou=CACHE_IOU)
+    predictions = load_predictions(args.cache, pipeline, image_paths, refresh=args.refresh)
+    print(f"⏱️ Pipeline ran at {float(predictions['seconds_per_image']) * 1000:.0f} ms/image when cached")
+
+    start = time.perf_counter()
+    rows = [evaluate(gt, predictions, len(image_paths), person_conf, ppe_conf, iou)
+            for person_conf, ppe_conf, iou in product(args.person_conf, args.ppe_conf, args.iou)]
+    print(f"✅ Scored {len(rows)} settings on {len(image_paths)} images in {time.perf_counter() - start:.1f}s")
+
+    print_sweep(rows)
+    print_classes(max(rows, key=lambda row: row["ap50_95"]))
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"images": len(image_paths), "cache": args.cache, "route": args.route, "settings": rows}, f, indent=2)
+    print(f"📄 Metrics saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
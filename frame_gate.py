@@ -0,0 +1,144 @@
+import os
+import threading
+from collections import OrderedDict, deque
+import cv2
+import numpy as np
+from metrics import METRICS
+from ppe_pipeline import DetectionResult
+
+# Mean absolute difference (0-255 grey levels) between frame thumbnails at or below which a
+# frame counts as a near-duplicate of an earlier one; 0 disables the gate
+DEDUP_THRESHOLD = float(os.environ.get("PPE_DEDUP_THRESHOLD", 0))
+
+# Thumbnails are THUMB_SIZE x THUMB_SIZE greyscale, compared in GRID x GRID cells
+THUMB_SIZE = 32
+GRID = 8
+
+# A cell whose mean difference exceeds this has changed; if at most MAX_CHANGED_SHARE of the
+# cells changed, only the region around them is re-run instead of the whole frame
+CELL_THRESHOLD = 12.0
+MAX_CHANGED_SHARE = 0.25
+
+# Recent processed frames remembered per source, and number of sources remembered
+HISTORY = 8
+MAX_SOURCES = 64
+
+
+def thumbnail(image):
+    """Returns the small greyscale signature of a BGR frame that frames are compared by."""
+    grey = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(grey, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def cell_differences(thumb_a, thumb_b):
+    """Returns the (GRID, GRID) mean absolute difference of two thumbnails per cell."""
+    cell = THUMB_SIZE // GRID
+    diff = np.abs(thumb_a - thumb_b).reshape(GRID, cell, GRID, cell)
+    return diff.mean(axis=(1, 3))
+
+
+def changed_region(changed, image_shape, person_boxes):
+    """Returns the xyxy pixel region covering the changed cells (plus one cell of margin) and
+    every earlier person box it touches, so no person is cut at its border."""
+    height, width = image_shape[:2]
+    rows, cols = np.nonzero(changed)
+    cell_h, cell_w = height / GRID, width / GRID
+    region = np.array([(cols.min() - 1) * cell_w, (rows.min() - 1) * cell_h,
+                       (cols.max() + 2) * cell_w, (rows.max() + 2) * cell_h], dtype=np.float32)
+    region = np.clip(region, 0, [width, height, width, height])
+
+    boxes = np.asarray(person_boxes, dtype=np.float32).reshape(-1, 4)
+    touching = ((boxes[:, 0] < region[2]) & (boxes[:, 2] > region[0]) &
+                (boxes[:, 1] < region[3]) & (boxes[:, 3] > region[1]))
+    if touching.any():
+        region[:2] = np.minimum(region[:2], boxes[touching, :2].min(axis=0))
+        region[2:] = np.maximum(region[2:], boxes[touching, 2:].max(axis=0))
+    return region.astype(int), touching
+
+
+def replace_region(cached, region, touching, region_result):
+    """Combines the persons of `cached` outside the region with the detections of a re-run of
+    the region (in region coordinates) into one DetectionResult."""
+    keep = ~touching
+    remap = np.cumsum(keep) - 1  # New index of each kept person
+    ppe_keep = keep[cached.ppe_parents]
+    offset = np.array([region[0], region[1], region[0], region[1]], dtype=np.float32)
+
+    return DetectionResult(
+        np.concatenate([cached.person_boxes[keep], region_result.person_boxes + offset]),
+        np.concatenate([cached.person_scores[keep], region_result.person_scores]),
+        np.concatenate([cached.ppe_boxes[ppe_keep], region_result.ppe_boxes + offset]),
+        np.concatenate([cached.ppe_classes[ppe_keep], region_result.ppe_classes]),
+        np.concatenate([cached.ppe_scores[ppe_keep], region_result.ppe_scores]),
+        np.concatenate([remap[cached.ppe_parents[ppe_keep]], region_result.ppe_parents + keep.sum()]),
+        np.concatenate([cached.person_assessable[keep], region_result.person_assessable]),
+    )
+
+
+class FrameGate:
+    """Skips the pipeline for frames that are near-duplicates of a recent frame of the same source.
+
+    Each source (camera, folder, ...) keeps its last `history` processed frames as thumbnails
+    with their results, and at most `max_sources` sources are kept (least recently seen are
+    dropped). A new frame within `threshold` of one of them reuses its detections; if only a
+    few cells changed, just the region around them is re-run; otherwise the full pipeline runs.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, history=HISTORY, max_sources=MAX_SOURCES,
+                 cell_threshold=CELL_THRESHOLD, max_changed_share=MAX_CHANGED_SHARE, partial=True):
+        self.threshold = threshold
+        self.history = history
+        self.max_sources = max_sources
+        self.cell_threshold = cell_threshold
+        self.max_changed_share = max_changed_share
+        self.partial = partial
+        self._sources = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {"reused": 0, "partial": 0, "full": 0}
+
+    @property
+    def skip_rate(self):
+        """Share of frames answered without running the models on the full frame."""
+        total = sum(self.counts.values())
+        return (self.counts["reused"] + self.counts["partial"]) / total if total else 0.0
+
+    def _recent(self, source):
+        with self._lock:
+            entries = self._sources.get(source)
+            if entries is None:
+                entries = self._sources[source] = deque(maxlen=self.history)
+                while len(self._sources) > self.max_sources:
+                    self._sources.popitem(last=False)
+            self._sources.move_to_end(source)
+            return list(entries), entries
+
+    def detect(self, pipeline, image, source="default"):
+        """Returns (result, action) for a frame, with action "reused", "partial" or "full"."""
+        thumb = thumbnail(image)
+        recent, entries = self._recent(source)
+
+        best, best_cells = None, None
+        for shape, entry_thumb, entry_result in recent:
+            if shape != image.shape:
+                continue
+            cells = cell_differences(thumb, entry_thumb)
+            if best_cells is None or cells.mean() < best_cells.mean():
+                best, best_cells = entry_result, cells
+
+        changed = best_cells > self.cell_threshold if best is not None else None
+        if best is not None and best_cells.mean() <= self.threshold:
+            action, result = "reused", best
+        elif best is not None and self.partial and changed.any() and changed.mean() <= self.max_changed_share:
+            region, touching = changed_region(changed, image.shape, best.person_boxes)
+            x1, y1, x2, y2 = region
+            action = "partial"
+            result = replace_region(best, region, touching, pipeline.detect(image[y1:y2, x1:x2]))
+        else:
+            action, result = "full", pipeline.detect(image)
+
+        if action != "reused":
+            entries.append((image.shape, thumb, result))
+        with self._lock:
+            self.counts[action] += 1
+        METRICS.inc("ppe_frame_gate_total", action=action)
+        return result, action
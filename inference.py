@@ -1,77 +1,189 @@
 import cv2
 import os
-from ultralytics import YOLO
-
-# Load trained models
-person_model = YOLO("weights/person_detection.pt")
-ppe_model = YOLO("weights/ppe_detection.pt")
-
-# Directories
-input_folder = "datasets/images"
-output_folder = "results"
-os.makedirs(output_folder, exist_ok=True)
-
-# Define PPE class names
-PPE_CLASSES = ["hard-hat", "gloves", "mask", "glasses", "boots", "vest", "ppe-suit", "ear-protector", "safety-harness"]
-
-def detect_ppe(image_path):
-    image = cv2.imread(image_path)
-
-    # Step 1: Detect persons
-    person_results = person_model(image)
-    
-    if len(person_results[0].boxes) == 0:
-        print(f"⚠️ No person detected in {image_path}. Skipping...")
-        return  # Skip if no person detected
-
-    for result in person_results:
-        boxes = result.boxes.xyxy.cpu().numpy()  # Convert to NumPy array
-        
-        for i, box in enumerate(boxes):
-            x1, y1, x2, y2 = map(int, box)
-
-            # Draw bounding box around person
-            cv2.rectangle(image, (x1, y1), (x2, y2), (255, 0, 0), 2)
-            cv2.putText(image, "Person", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 0, 0), 2)
-
-            # Crop the detected person
-            cropped_image = image[y1:y2, x1:x2].copy()
-
-            # Step 2: Detect PPE on cropped person
-            ppe_results = ppe_model(cropped_image)
-
-            if len(ppe_results[0].boxes) == 0:
-                print(f"⚠️ No PPE detected on person {i} in {image_path}.")
-                continue  # Skip if no PPE detected
-
-            for ppe_result in ppe_results:
-                ppe_boxes = ppe_result.boxes.xyxy.cpu().numpy()
-                ppe_classes = ppe_result.boxes.cls.cpu().numpy()
-
-                for j, ppe_box in enumerate(ppe_boxes):
-                    px1, py1, px2, py2 = map(int, ppe_box)
-
-                    # Adjust PPE coordinates relative to full image
-                    px1 += x1
-                    py1 += y1
-                    px2 += x1
-                    py2 += y1
-
-                    class_id = int(ppe_classes[j])
-                    label = PPE_CLASSES[class_id] if class_id < len(PPE_CLASSES) else "PPE"
-
-                    # Draw PPE bounding box
-                    cv2.rectangle(image, (px1, py1), (px2, py2), (0, 255, 0), 2)
-                    cv2.putText(image, label, (px1, py1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-    # Save the output image
-    output_path = os.path.join(output_folder, os.path.basename(image_path))
-    cv2.imwrite(output_path, image)
-    print(f"✅ Processed: {image_path} -> {output_path}")
-
-# Process all images in the input directory
-for img_file in os.listdir(input_folder):
-    if img_file.endswith(".jpg") or img_file.endswith(".png"):
-        detect_ppe(os.path.join(input_folder, img_file))
-
-print("✅ Inference Complete! Results saved in 'results/'")
+import time
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from detection_output import open_writer
+from frame_gate import DEDUP_THRESHOLD, FrameGate
+from metrics import METRICS, METRICS_LOG_EVERY, start_periodic_log
+from ppe_pipeline import PPEPipeline, draw_detections
+
+IMAGE_EXTENSIONS = (".jpg", ".png")
+
+def list_images(input_folder):
+    """Returns the sorted paths of all images in a folder."""
+    return [
+        os.path.join(input_folder, img_file)
+        for img_file in sorted(os.listdir(input_folder))
+        if img_file.endswith(IMAGE_EXTENSIONS)
+    ]
+
+def save_result(image, output_path):
+    """Encodes and writes an annotated image (runs on the writer threads)."""
+    with METRICS.timer("write"):
+        cv2.imwrite(output_path, image)
+    return output_path
+
+def process_images(image_paths, output_folder, decode_workers=2, write_workers=2, pipeline=None,
+                   records_path=None, render=True, dedup_threshold=0):
+    """Runs the pipeline over `image_paths` and returns how many images were processed.
+
+    JPEG decoding runs ahead of inference and encoding/writing runs behind it in thread
+    pools (OpenCV releases the GIL for both), so the models are rarely left waiting on I/O.
+    Detection records are streamed to `records_path` (JSONL or Parquet) when given; with
+    `render` off no annotated images are drawn or written at all.
+
+    With a `dedup_threshold`, near-duplicates of recent images from the same folder reuse
+    their detections (see FrameGate).
+    """
+    pipeline = pipeline or PPEPipeline()
+    gate = FrameGate(dedup_threshold) if dedup_threshold > 0 else None
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Bound the number of decoded and annotated frames held in memory at once
+    prefetch = max(1, decode_workers * 2)
+    max_pending_writes = max(1, write_workers * 2)
+    processed = 0
+    records = open_writer(records_path) if records_path else None
+
+    with ThreadPoolExecutor(decode_workers) as decoder, ThreadPoolExecutor(write_workers) as writer:
+        paths = iter(image_paths)
+        decoding = deque()
+        writing = deque()
+
+        def submit_next_decode():
+            image_path = next(paths, None)
+            if image_path is not None:
+                decoding.append((image_path, decoder.submit(cv2.imread, image_path)))
+
+        for _ in range(prefetch):
+            submit_next_decode()
+
+        while decoding:
+            image_path, future = decoding.popleft()
+            submit_next_decode()
+            image = future.result()
+
+            if image is None:
+                print(f"⚠️ Could not read {image_path}. Skipping...")
+                continue
+
+            # Run person detection followed by batched PPE detection on the crops
+            if gate:
+                result, _ = gate.detect(pipeline, image, source=os.path.dirname(image_path))
+            else:
+                result = pipeline.detect(image)
+            processed += 1
+            if records:
+                records.write(os.path.basename(image_path), result)
+
+            if len(result.person_boxes) == 0:
+                print(f"⚠️ No person detected in {image_path}. Skipping...")
+                continue  # Skip if no person detected
+
+            for i in range(len(result.person_boxes)):
+                if not result.person_assessable[i]:
+                    print(f"⚠️ Person {i} in {image_path} is too small to assess PPE.")
+                elif not result.ppe_for_person(i).any():
+                    print(f"⚠️ No PPE detected on person {i} in {image_path}.")
+
+            if not render:
+                continue
+
+            draw_detections(image, result)
+
+            # Save the output image
+            output_path = os.path.join(output_folder, os.path.basename(image_path))
+            writing.append(writer.submit(save_result, image, output_path))
+            while len(writing) > max_pending_writes:
+                writing.popleft().result()
+            print(f"✅ Processed: {image_path} -> {output_path}")
+
+        for future in writing:
+            future.result()
+
+    if records:
+        records.close()
+    if gate:
+        print(f"🔁 Near-duplicate gate: {gate.counts['reused']} reused, {gate.counts['partial']} partially "
+              f"re-run, {gate.counts['full']} full ({gate.skip_rate:.0%} skipped)")
+    return processed
+
+def _init_worker(threads_per_process, metrics_every=0):
+    """Keeps each shard process from oversubscribing the CPU with torch threads."""
+    import torch
+    torch.set_num_threads(threads_per_process)
+    start_periodic_log(metrics_every)
+
+def _process_shard(shard):
+    # Each process loads its own copy of the models on first use
+    image_paths, output_folder, decode_workers, write_workers, records_path, render, dedup_threshold = shard
+    return process_images(image_paths, output_folder, decode_workers, write_workers, records_path=records_path,
+                          render=render, dedup_threshold=dedup_threshold)
+
+def shard_paths(image_paths, processes, contiguous=False):
+    """Splits the images between processes: interleaved by default, which balances the shards
+    when image sizes vary along the folder, or in contiguous runs so consecutive snapshots of
+    a camera stay in one process, as the near-duplicate gate needs."""
+    if not contiguous:
+        return [image_paths[i::processes] for i in range(processes)]
+    size = -(-len(image_paths) // processes)
+    return [image_paths[i * size:(i + 1) * size] for i in range(processes)]
+
+def shard_records_path(records_path, shard_idx):
+    """Gives every shard process its own records file, e.g. detections-1.jsonl."""
+    if not records_path:
+        return None
+    root, ext = os.path.splitext(records_path)
+    return f"{root}-{shard_idx}{ext}"
+
+def main():
+    parser = ArgumentParser(description="Run person and PPE detection over a folder of images.")
+    parser.add_argument("--input", default="datasets/images", help="Folder with input images.")
+    parser.add_argument("--output", default="results", help="Folder to save annotated images.")
+    parser.add_argument("--decode-workers", type=int, default=2, help="Threads decoding images ahead of inference.")
+    parser.add_argument("--write-workers", type=int, default=2, help="Threads encoding and writing results.")
+    parser.add_argument("--records", default="results/detections.jsonl",
+                        help="Detection records file (.jsonl or .parquet); empty to disable.")
+    parser.add_argument("--processes", type=int, default=1, help="Shard the folder across this many processes.")
+    parser.add_argument("--no-render", action="store_true",
+                        help="Only write detection records, skip drawing and saving annotated images.")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="Reuse detections of near-identical recent images (mean grey-level difference); 0 disables.")
+    parser.add_argument("--metrics-every", type=float, default=METRICS_LOG_EVERY,
+                        help="Print a stage timing summary every N seconds (0 disables).")
+    args = parser.parse_args()
+
+    # Load the models while the folder is listed; shard processes load their own
+    pipeline = PPEPipeline().load_async() if args.processes <= 1 else None
+    image_paths = list_images(args.input)
+    if not image_paths:
+        print(f"❌ Error: No images found in {args.input}!")
+        return
+
+    start = time.perf_counter()
+
+    if args.processes > 1:
+        shards = [
+            (paths, args.output, args.decode_workers, args.write_workers,
+             shard_records_path(args.records, i), not args.no_render, args.dedup_threshold)
+            for i, paths in enumerate(shard_paths(image_paths, args.processes, contiguous=args.dedup_threshold > 0))
+        ]
+        threads_per_process = max(1, (os.cpu_count() or 1) // args.processes)
+        with ProcessPoolExecutor(args.processes, initializer=_init_worker,
+                                 initargs=(threads_per_process, args.metrics_every)) as pool:
+            processed = sum(pool.map(_process_shard, shards))
+    else:
+        start_periodic_log(args.metrics_every)
+        processed = process_images(image_paths, args.output, args.decode_workers, args.write_workers,
+                                   pipeline=pipeline, records_path=args.records, render=not args.no_render,
+                                   dedup_threshold=args.dedup_threshold)
+        print(METRICS.log_line())
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Inference Complete! Results saved in '{args.output}/'")
+    print(f"⏱️ {processed} images in {elapsed:.1f}s ({processed / elapsed:.2f} images/sec)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import cProfile
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Set PPE_METRICS=0 to turn all timers and counters into no-ops
+METRICS_ENABLED = os.environ.get("PPE_METRICS", "1") != "0"
+
+# Seconds between one-line metrics summaries printed by the long-running entry points (0 disables)
+METRICS_LOG_EVERY = float(os.environ.get("PPE_METRICS_LOG_EVERY", 0))
+
+# Opt-in: run each request under cProfile and keep the dump when it takes longer than this
+PROFILE_SLOW_MS = float(os.environ.get("PPE_PROFILE_SLOW_MS", 0))
+PROFILE_FOLDER = os.environ.get("PPE_PROFILE_FOLDER", "profiles")
+
+# Histogram bucket upper bounds: durations in seconds, sizes (persons, crops, images) in items
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout; the last bucket is +Inf."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Metrics:
+    """Process-wide stage timers, counters and gauges, cheap enough to leave on under load.
+
+    Every update is a dict lookup and a few additions under one lock; nothing is stored per
+    request, so memory stays constant. The data is exposed as Prometheus text (render) or
+    as a compact summary line (log_line).
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED, profile_slow_ms=PROFILE_SLOW_MS, profile_folder=PROFILE_FOLDER):
+        self.enabled = enabled
+        self.profile_slow_ms = profile_slow_ms
+        self.profile_folder = profile_folder
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._local = threading.local()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=COUNT_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage):
+        """Records the wall time of the enclosed block under ppe_stage_seconds{stage=...}."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("ppe_stage_seconds", time.perf_counter() - start, TIME_BUCKETS, stage=stage)
+
+    @contextmanager
+    def request(self, name):
+        """Times one request end to end; with profiling on, keeps a cProfile dump of slow ones."""
+        if not self.enabled:
+            yield
+            return
+        profiler = None
+        if self.profile_slow_ms and not getattr(self._local, "profiling", False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # Another profiler is already active on this thread
+                profiler = None
+            else:
+                self._local.profiling = True
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("ppe_request_seconds", elapsed, TIME_BUCKETS, request=name)
+            if profiler is not None:
+                profiler.disable()
+                self._local.profiling = False
+                if elapsed * 1000 >= self.profile_slow_ms:
+                    self._dump_profile(profiler, name, elapsed)
+
+    def _dump_profile(self, profiler, name, elapsed):
+        os.makedirs(self.profile_folder, exist_ok=True)
+        path = os.path.join(self.profile_folder, f"{name}-{time.time_ns()}-{elapsed * 1000:.0f}ms.prof")
+        profiler.dump_stats(path)
+        self.inc("ppe_slow_requests_total", request=name)
+
+    def _snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {
+                key: (h.buckets, list(h.counts), h.count, h.sum) for key, h in self._histograms.items()
+            }
+        return counters, gauges, histograms
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        counters, gauges, histograms = self._snapshot()
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{_label_text(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            declare(name, "gauge")
+            lines.append(f"{name}{_label_text(labels)} {value}")
+        for (name, labels), (buckets, counts, count, total) in sorted(histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {total}")
+            lines.append(f"{name}_count{_label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def log_line(self):
+        """Returns a one-line summary: mean stage times, mean sizes and cache hit rates."""
+        counters, _, histograms = self._snapshot()
+        parts = []
+        for (name, labels), (_, _, count, total) in sorted(histograms.items()):
+            if not count:
+                continue
+            label = ",".join(str(value) for _, value in labels) or name.removeprefix("ppe_")
+            if name.endswith("_seconds"):
+                parts.append(f"{label} {total / count * 1000:.1f}ms x{count}")
+            else:
+                parts.append(f"{label} {total / count:.1f}")
+
+        caches = {}
+        for (name, labels), value in counters.items():
+            if name == "ppe_cache_requests_total":
+                labels = dict(labels)
+                caches.setdefault(labels["cache"], {})[labels["result"]] = value
+        for cache, results in sorted(caches.items()):
+            lookups = results.get("hit", 0) + results.get("miss", 0)
+            parts.append(f"{cache} cache {results.get('hit', 0) / lookups:.0%} hits")
+        return "📈 " + (" | ".join(parts) if parts else "no requests yet")
+
+
+# Shared by the pipeline and every entry point in this process
+METRICS = Metrics()
+
+
+def start_periodic_log(interval=METRICS_LOG_EVERY, metrics=METRICS):
+    """Prints metrics.log_line() every `interval` seconds from a daemon thread; returns it or None."""
+    if interval <= 0 or not metrics.enabled:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            print(metrics.log_line(), flush=True)
+
+    thread = threading.Thread(target=run, name="metrics-log", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,87 @@
+import json
+import os
+from argparse import ArgumentParser
+from ultralytics import YOLO
+from ppe_pipeline import BACKENDS, backend_available, backend_weights, compare_record_path
+
+EXPORT_FORMATS = ["onnx", "openvino"]
+
+# Largest mAP50-95 drop against the .pt model for which PPE_BACKEND=auto switches to INT8
+MAX_INT8_MAP_DROP = float(os.environ.get("PPE_MAX_INT8_MAP_DROP", 0.01))
+
+def export_model(weights, export_format, data=None, imgsz=640, int8=False):
+    """Exports .pt weights to an optimized CPU format next to them and returns the artifact path.
+
+    Exports use dynamic input shapes so the pipeline can batch person crops. INT8 quantization
+    is only supported for OpenVINO and calibrates on the images of the `data` YAML.
+    """
+    if int8 and export_format != "openvino":
+        raise ValueError("INT8 export is only supported for the openvino format")
+    if int8 and not data:
+        raise ValueError("INT8 export needs a dataset YAML (--data) for calibration images")
+
+    model = YOLO(weights)
+    exported = model.export(format=export_format, imgsz=imgsz, dynamic=True, int8=int8, data=data)
+
+    backend = "openvino-int8" if int8 else export_format
+    target = backend_weights(weights, backend)
+    print(f"✅ Exported {weights} -> {exported}")
+    return target if os.path.exists(target) else exported
+
+def compare_backends(weights, data, imgsz=640, backends=None):
+    """Validates every available backend of a model on `data` and prints mAP and CPU speed side by side.
+
+    The results are recorded next to the weights; PPE_BACKEND=auto only uses the INT8 model
+    once such a record shows its mAP50-95 within MAX_INT8_MAP_DROP of the .pt model.
+    """
+    rows = []
+    for backend in backends or BACKENDS:
+        if not backend_available(weights, backend):
+            continue
+        metrics = YOLO(backend_weights(weights, backend), task="detect").val(
+            data=data, imgsz=imgsz, batch=1, device="cpu", plots=False, verbose=False)
+        rows.append((backend, metrics.box.map50, metrics.box.map, metrics.speed["inference"]))
+
+    if not rows:
+        print(f"❌ Error: No backend artifacts found for {weights}!")
+        return rows
+
+    baseline = next((row for row in rows if row[0] == "pt"), rows[-1])
+    print(f"📊 {weights} on {data}")
+    print(f"{'backend':<15}{'mAP50':>8}{'mAP50-95':>10}{'ms/img':>9}{'speedup':>9}")
+    for backend, map50, map5095, inference_ms in rows:
+        print(f"{backend:<15}{map50:>8.3f}{map5095:>10.3f}{inference_ms:>9.1f}"
+              f"{baseline[3] / max(inference_ms, 1e-6):>8.2f}x")
+
+    maps = {backend: map5095 for backend, _, map5095, _ in rows}
+    int8_accepted = "openvino-int8" in maps and "pt" in maps and maps["pt"] - maps["openvino-int8"] <= MAX_INT8_MAP_DROP
+    if "openvino-int8" in maps:
+        print(f"{'✅' if int8_accepted else '⚠️'} INT8 {'will' if int8_accepted else 'will not'} be used by "
+              f"PPE_BACKEND=auto (mAP50-95 drop limit {MAX_INT8_MAP_DROP})")
+    with open(compare_record_path(weights), "w") as f:
+        json.dump({"weights_mtime": os.path.getmtime(weights), "data": data, "int8_accepted": bool(int8_accepted),
+                   "rows": [dict(zip(["backend", "map50", "map50_95", "inference_ms"], row)) for row in rows]}, f,
+                  indent=2)
+    return rows
+
+def main():
+    parser = ArgumentParser(description="Export YOLOv8 weights for CPU inference and compare backends.")
+    parser.add_argument("weights", help="Path to the trained .pt weights.")
+    parser.add_argument("--data", help="Dataset YAML used for INT8 calibration and the accuracy check.")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="Export format; omit to only compare.")
+    parser.add_argument("--int8", action="store_true", help="INT8-quantize the OpenVINO export.")
+    parser.add_argument("--imgsz", type=int, default=640, help="Image size for export and validation.")
+    parser.add_argument("--compare", action="store_true", help="Compare mAP and speed of all available backends.")
+    args = parser.parse_args()
+
+    if args.format:
+        export_model(args.weights, args.format, data=args.data, imgsz=args.imgsz, int8=args.int8)
+
+    if args.compare:
+        if not args.data:
+            print("❌ Error: --compare needs --data!")
+            return
+        compare_backends(args.weights, args.data, imgsz=args.imgsz)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+import hashlib
+import json
+import math
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import yaml
+from ultralytics.data import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils.torch_utils import de_parallel
+
+# Files of a pack folder: raw pixels, per-image index, concatenated labels and metadata
+PIXELS_FILE = "images.bin"
+INDEX_FILE = "index.npy"
+LABELS_FILE = "labels.npy"
+META_FILE = "meta.json"
+
+# Bumped whenever the pack format changes (2: ceil sizes and INTER_LINEAR, 3: source fingerprint
+# in meta.json); older packs are rebuilt
+PACK_VERSION = 3
+
+# Index columns: byte offset into PIXELS_FILE, stored height and width, original height and
+# width, and the [start, end) rows of the image's labels in LABELS_FILE
+INDEX_COLUMNS = ["offset", "height", "width", "orig_height", "orig_width", "label_start", "label_end"]
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def pack_dir(images_dir, imgsz):
+    """Returns the pack folder used for an images folder, next to it (e.g. train/packed_640), or
+    for an image list file (e.g. datasets/packed_train_640 for datasets/train.txt)."""
+    parent, name = os.path.split(os.path.normpath(images_dir))
+    if os.path.isfile(images_dir):
+        return os.path.join(parent, f"packed_{os.path.splitext(name)[0]}_{imgsz}")
+    return os.path.join(parent, f"packed_{imgsz}")
+
+
+def image_files(images_dir):
+    """Returns the sorted image paths of an images folder or of an image list file (one path per
+    line, relative paths resolved against the list's folder, as Ultralytics does)."""
+    if os.path.isfile(images_dir):
+        with open(images_dir) as f:
+            paths = [os.path.join(os.path.dirname(images_dir), line.strip()) for line in f if line.strip()]
+    else:
+        paths = [os.path.join(images_dir, name) for name in os.listdir(images_dir)]
+    return sorted(os.path.normpath(path) for path in paths if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def label_path(image_path):
+    """Returns the YOLO label file of an image: split/images/x.jpg -> split/labels/x.txt, or
+    split/labels/x.txt for images stored directly in the split folder."""
+    images_dir, name = os.path.split(image_path)
+    parent, folder = os.path.split(images_dir)
+    labels_dir = os.path.join(parent if folder == "images" else images_dir, "labels")
+    return os.path.join(labels_dir, os.path.splitext(name)[0] + ".txt")
+
+
+def load_and_resize(image_path, imgsz):
+    """Decodes an image and resizes its long side to `imgsz` the way Ultralytics' load_image does
+    when augmenting (ceil sizes, INTER_LINEAR), so packed training images match those read from disk."""
+    image = cv2.imread(image_path)
+    if image is None:
+        return None, None
+    orig_h, orig_w = image.shape[:2]
+    scale = imgsz / max(orig_h, orig_w)
+    if scale != 1:
+        size = (min(math.ceil(orig_w * scale), imgsz), min(math.ceil(orig_h * scale), imgsz))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(image), (orig_h, orig_w)
+
+
+def source_fingerprint(images_dir):
+    """Summarizes the images and labels a pack is built from: their number, a digest of their
+    paths and the newest image and label modification times. Any added, removed, renamed or
+    edited file changes it, at the cost of one stat per file instead of reading them."""
+    image_paths = image_files(images_dir)
+    label_paths = [path for path in map(label_path, image_paths) if os.path.exists(path)]
+    return {
+        "count": len(image_paths),
+        "paths_digest": hashlib.sha1("\n".join(image_paths).encode()).hexdigest(),
+        "newest_image_mtime": max(map(os.path.getmtime, image_paths), default=0.0),
+        "newest_label_mtime": max(map(os.path.getmtime, label_paths), default=0.0),
+        "label_count": len(label_paths),
+    }
+
+
+def _pack_job(job):
+    image_path, imgsz = job
+    image, orig_shape = load_and_resize(image_path, imgsz)
+    labels = np.zeros((0, 5), dtype=np.float32)
+    path = label_path(image_path)
+    if os.path.exists(path) and os.path.getsize(path):
+        labels = np.loadtxt(path, dtype=np.float32, ndmin=2).reshape(-1, 5)
+    return image_path, image, orig_shape, labels
+
+
+def pack_images(images_dir, imgsz=640, workers=None, output_dir=None):
+    """Decodes, resizes and packs every image of `images_dir` (a folder or an image list file) with
+    its labels; returns the pack folder.
+
+    Images are decoded in a process pool and appended in sorted order to one raw file, so
+    training reads a memory-mapped slice instead of opening and decoding a JPEG per sample.
+    """
+    output_dir = output_dir or pack_dir(images_dir, imgsz)
+    fingerprint = source_fingerprint(images_dir)
+    image_paths = image_files(images_dir)
+    if not image_paths:
+        print(f"❌ Error: No images found in {images_dir}!")
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"🔄 Packing {len(image_paths)} images from {images_dir} at {imgsz}px...")
+
+    files, index, labels = [], [], []
+    offset = label_rows = 0
+    with open(os.path.join(output_dir, PIXELS_FILE + ".tmp"), "wb") as pixels, \
+            ProcessPoolExecutor(max(workers or os.cpu_count() or 1, 1)) as pool:
+        jobs = [(path, imgsz) for path in image_paths]
+        for image_path, image, orig_shape, image_labels in pool.map(_pack_job, jobs, chunksize=16):
+            if image is None:
+                print(f"⚠️ Could not read {image_path}. Skipping...")
+                continue
+            pixels.write(image.data)
+            files.append(os.path.abspath(image_path))
+            index.append((offset, *image.shape[:2], *orig_shape, label_rows, label_rows + len(image_labels)))
+            labels.append(image_labels)
+            offset += image.nbytes
+            label_rows += len(image_labels)
+
+    os.replace(os.path.join(output_dir, PIXELS_FILE + ".tmp"), os.path.join(output_dir, PIXELS_FILE))
+    np.save(os.path.join(output_dir, INDEX_FILE), np.array(index, dtype=np.int64).reshape(-1, len(INDEX_COLUMNS)))
+    np.save(os.path.join(output_dir, LABELS_FILE), np.concatenate(labels) if labels else np.zeros((0, 5), np.float32))
+    with open(os.path.join(output_dir, META_FILE), "w") as f:
+        json.dump({"version": PACK_VERSION, "imgsz": imgsz, "images_dir": os.path.abspath(images_dir),
+                   "source": fingerprint, "files": files}, f)
+
+    print(f"✅ Packed {len(files)} images ({offset / 1e6:.0f} MB) and {label_rows} labels into {output_dir}")
+    return output_dir
+
+
+def pack_is_current(path):
+    """True if `path` holds a complete pack written by this version of the packer from the
+    images and labels its source folder or list holds now."""
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("version") != PACK_VERSION or not os.path.exists(meta["images_dir"]):
+        return False
+    if meta["source"] != source_fingerprint(meta["images_dir"]):
+        print(f"🔄 Images or labels of {meta['images_dir']} changed since {path} was packed.")
+        return False
+    return True
+
+
+class PackedImages:
+    """Read-only view of a pack folder: images come from a memory map, nothing is decoded."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        self.imgsz = meta["imgsz"]
+        self.files = meta["files"]
+        self.index = np.load(os.path.join(path, INDEX_FILE))
+        self.labels = np.load(os.path.join(path, LABELS_FILE))
+        self._pixels = None
+
+    @property
+    def pixels(self):
+        # Opened lazily so every dataloader worker maps the file itself
+        if self._pixels is None:
+            self._pixels = np.memmap(os.path.join(self.path, PIXELS_FILE), dtype=np.uint8, mode="r")
+        return self._pixels
+
+    def __getstate__(self):
+        # Never pickle the mapped pixels into spawned dataloader workers
+        return {**self.__dict__, "_pixels": None}
+
+    def __len__(self):
+        return len(self.index)
+
+    def image(self, i):
+        """Returns image `i` (resized, BGR) as a read-only view into the memory map."""
+        offset, height, width = self.index[i, :3]
+        return self.pixels[offset:offset + height * width * 3].reshape(height, width, 3)
+
+    def original_shape(self, i):
+        return tuple(int(v) for v in self.index[i, 3:5])
+
+    def image_labels(self, i):
+        """Returns the (N, 5) class, x_center, y_center, width, height labels of image `i`."""
+        start, end = self.index[i, 5:7]
+        return self.labels[start:end]
+
+
+def dataset_splits(data_yaml):
+    """Returns the {split: images folder or image list file} entries of an Ultralytics dataset YAML."""
+    with open(data_yaml) as f:
+        data = yaml.safe_load(f)
+    # Without a `path` entry, Ultralytics resolves the splits relative to the YAML's folder
+    yaml_dir = os.path.dirname(os.path.abspath(data_yaml))
+    root = os.path.join(yaml_dir, data["path"]) if data.get("path") else yaml_dir
+    return {split: os.path.join(root, data[split]) for split in ["train", "val", "test"] if data.get(split)}
+
+
+def ensure_packs(data_yaml, imgsz=640, workers=None):
+    """Packs every split of a dataset YAML that has no pack for `imgsz` yet."""
+    for images_dir in dict.fromkeys(dataset_splits(data_yaml).values()):
+        if not pack_is_current(pack_dir(images_dir, imgsz)):
+            pack_images(images_dir, imgsz=imgsz, workers=workers)
+
+
+class PackedYOLODataset(YOLODataset):
+    """YOLODataset that serves images and labels from a pack folder instead of the image files."""
+
+    def __init__(self, pack, *args, **kwargs):
+        self.pack = pack
+        super().__init__(*args, **kwargs)
+
+    def get_img_files(self, img_path):
+        return list(self.pack.files)
+
+    def get_labels(self):
+        labels = []
+        for i, im_file in enumerate(self.pack.files):
+            rows = self.pack.image_labels(i)
+            labels.append({
+                "im_file": im_file,
+                "shape": self.pack.original_shape(i),
+                "cls": rows[:, :1].copy(),
+                "bboxes": rows[:, 1:].copy(),
+                "segments": [],
+                "keypoints": None,
+                "normalized": True,
+                "bbox_format": "xywh",
+            })
+        return labels
+
+    def load_image(self, i, rect_mode=True):
+        if self.ims[i] is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+
+        # Copy out of the read-only map: the augmentations modify images in place
+        image = np.array(self.pack.image(i))
+        orig_shape = self.pack.original_shape(i)
+        if not rect_mode and image.shape[:2] != (self.imgsz, self.imgsz):
+            image = cv2.resize(image, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+
+        if self.augment:
+            # Same bookkeeping as BaseDataset.load_image: Mosaic picks its partner images from self.buffer
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = image, orig_shape, image.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return image, orig_shape, image.shape[:2]
+
+
+class PackedDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer that reads each split from its pack when one exists for the training imgsz.
+
+    Pass it to YOLO(...).train(trainer=PackedDetectionTrainer); splits without a pack are read
+    from disk as usual.
+    """
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        path = pack_dir(img_path, self.args.imgsz)
+        if not pack_is_current(path):
+            print(f"⚠️ No current pack at {path}, reading {img_path} from disk.")
+            return super().build_dataset(img_path, mode, batch)
+
+        stride = max(int(de_parallel(self.model).stride.max() if self.model else 0), 32)
+        return PackedYOLODataset(
+            PackedImages(path),
+            img_path=img_path,
+            imgsz=self.args.imgsz,
+            batch_size=batch,
+            augment=mode == "train",
+            hyp=self.args,
+            rect=self.args.rect or mode == "val",
+            cache=False,
+            single_cls=self.args.single_cls or False,
+            stride=stride,
+            pad=0.0 if mode == "train" else 0.5,
+            prefix=f"{mode}: ",
+            task=self.args.task,
+            classes=self.args.classes,
+            data=self.data,
+        )
+
+
+def main():
+    parser = ArgumentParser(description="Pack a YOLO dataset into memory-mapped training caches.")
+    parser.add_argument("--data", help="Dataset YAML; every split folder in it is packed.")
+    parser.add_argument("--images", nargs="*", default=[],
+                        help="Image folders or image list files to pack (labels in ../labels).")
+    parser.add_argument("--imgsz", type=int, default=640, help="Training image size (long side of packed images).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Decoder processes.")
+    args = parser.parse_args()
+
+    folders = list(args.images)
+    if args.data:
+        folders += list(dataset_splits(args.data).values())
+    if not folders:
+        print("❌ Error: Pass --data or --images!")
+        return
+
+    # Splits that share a folder (e.g. train and val both on datasets/images) are packed once
+    for images_dir in dict.fromkeys(folders):
+        pack_images(images_dir, imgsz=args.imgsz, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
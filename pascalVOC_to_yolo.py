@@ -1,8 +1,20 @@
+import hashlib
+import json
 import os
 import xml.etree.ElementTree as ET
 from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-def convert_annotation(xml_file, output_dir, classes):
+# Records mtime, content hash and per-class counts of every converted XML file
+MANIFEST_NAME = ".voc2yolo_manifest.json"
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def convert_annotation(xml_file, output_dir, class_ids):
+    """Writes the YOLO label file for one PascalVOC XML file; returns its file name and per-class object counts."""
     tree = ET.parse(xml_file)
     root = tree.getroot()
 
@@ -11,11 +23,12 @@ def convert_annotation(xml_file, output_dir, classes):
     height = int(root.find("size/height").text)
 
     yolo_annotations = []
+    counts = Counter()
     for obj in root.findall("object"):
         cls = obj.find("name").text
-        if cls not in classes:
+        cls_id = class_ids.get(cls)
+        if cls_id is None:
             continue
-        cls_id = classes.index(cls)
         bbox = obj.find("bndbox")
         xmin = int(bbox.find("xmin").text)
         ymin = int(bbox.find("ymin").text)
@@ -29,45 +42,130 @@ def convert_annotation(xml_file, output_dir, classes):
         h = (ymax - ymin) / height
 
         yolo_annotations.append(f"{cls_id} {x_center:.6f} {y_center:.6f} {w:.6f} {h:.6f}")
+        counts[cls] += 1
 
     # Save YOLO annotation file
     output_file = os.path.join(output_dir, os.path.splitext(image_name)[0] + ".txt")
     with open(output_file, "w") as f:
         f.write("\n".join(yolo_annotations))
 
-def main():
-    parser = ArgumentParser(description="Convert PascalVOC annotations to YOLOv8 format.")
-    parser.add_argument("input_dir", help="Path to the directory containing PascalVOC annotations.")
-    parser.add_argument("output_dir", help="Path to save YOLOv8 annotations.")
-    args = parser.parse_args()
+    return os.path.basename(output_file), counts
+
+def _convert_job(job):
+    """Worker entry point: skips files whose content hash is unchanged, converts the rest."""
+    xml_file, output_dir, class_ids, previous_digest = job
+    digest = file_digest(xml_file)
+    if digest == previous_digest:
+        return xml_file, digest, None, None
+    label, counts = convert_annotation(xml_file, output_dir, class_ids)
+    return xml_file, digest, label, dict(counts)
+
+def load_manifest(output_dir, classes):
+    """Returns the manifest entries of the last run, or {} if missing or made with other classes."""
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("classes") != classes:
+        print("⚠️ Class list changed since the last run, reconverting everything.")
+        return {}
+    return manifest.get("files", {})
 
+def save_manifest(output_dir, classes, entries):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({"classes": classes, "files": entries}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def convert_folder(input_dir, output_dir, workers=None, incremental=False, progress_every=1000):
+    """Converts `input_dir`/labels/*.xml using `input_dir`/classes.txt; returns per-class totals or None."""
     # Load class names
-    classes_file = os.path.join(args.input_dir, "classes.txt")
+    classes_file = os.path.join(input_dir, "classes.txt")
     if not os.path.exists(classes_file):
         print(f"❌ Error: {classes_file} not found!")
-        return
+        return None
 
     with open(classes_file, "r") as f:
         classes = [line.strip() for line in f.readlines()]
+    class_ids = {name: idx for idx, name in enumerate(classes)}
 
     # Create output directory if it doesn't exist
-    os.makedirs(args.output_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
 
     # Process all XML files in the "labels" folder
-    labels_folder = os.path.join(args.input_dir, "labels")
+    labels_folder = os.path.join(input_dir, "labels")
     if not os.path.exists(labels_folder):
         print(f"❌ Error: Labels folder '{labels_folder}' not found!")
-        return
+        return None
+
+    previous = load_manifest(output_dir, classes) if incremental else {}
+    entries = {}
+    jobs = []
+    for entry in os.scandir(labels_folder):
+        if not entry.name.endswith(".xml"):
+            continue
+        mtime = entry.stat().st_mtime
+        old = previous.get(entry.name)
+        if old and not (old.get("label") and os.path.exists(os.path.join(output_dir, old["label"]))):
+            old = None  # Label file deleted since the last run (or manifest predates "label"): reconvert
+        if old and old["mtime"] == mtime:
+            entries[entry.name] = old  # Untouched since the last run
+        else:
+            jobs.append((entry.path, output_dir, class_ids, old["sha1"] if old else None))
 
-    for xml_file in os.listdir(labels_folder):
-        if xml_file.endswith(".xml"):
-            convert_annotation(
-                os.path.join(labels_folder, xml_file),
-                args.output_dir,
-                classes
-            )
+    print(f"🔄 Converting {len(jobs)} XML files ({len(entries)} unchanged)...")
+
+    totals = Counter()
+    for old in entries.values():
+        totals.update(old["counts"])
+
+    converted = 0
+    with ProcessPoolExecutor(max(workers or os.cpu_count() or 1, 1)) as pool:
+        for done, (xml_file, digest, label, counts) in enumerate(
+                pool.map(_convert_job, jobs, chunksize=64), start=1):
+            name = os.path.basename(xml_file)
+            if counts is None:
+                label, counts = previous[name]["label"], previous[name]["counts"]  # Touched but identical content
+            else:
+                converted += 1
+            entries[name] = {"mtime": os.path.getmtime(xml_file), "sha1": digest, "label": label, "counts": counts}
+            totals.update(counts)
+
+            if done % progress_every == 0:
+                print(f"   {done}/{len(jobs)} files, objects so far: {dict(totals)}")
+
+    # Labels of XML files deleted (or pointed at another image) since the last run would otherwise
+    # keep training on annotations that no longer exist
+    current = {entry["label"] for entry in entries.values()}
+    stale = {old["label"] for old in previous.values() if old.get("label")} - current
+    for label in stale:
+        path = os.path.join(output_dir, label)
+        if os.path.exists(path):
+            os.remove(path)
+    if stale:
+        print(f"🗑️ Removed {len(stale)} labels whose XML files are gone.")
+
+    save_manifest(output_dir, classes, entries)
+
+    print("✅ Conversion completed! YOLOv8 labels saved in", output_dir)
+    print(f"📊 {converted} files converted, {len(entries) - converted} up to date. Objects per class:")
+    for cls in classes:
+        print(f"   {cls}: {totals.get(cls, 0)}")
+    return totals
+
+def main():
+    parser = ArgumentParser(description="Convert PascalVOC annotations to YOLOv8 format.")
+    parser.add_argument("input_dir", help="Path to the directory containing PascalVOC annotations.")
+    parser.add_argument("output_dir", help="Path to save YOLOv8 annotations.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of converter processes.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only reconvert XML files whose mtime and content changed since the last run.")
+    parser.add_argument("--progress-every", type=int, default=1000, help="Print running class counts every N files.")
+    args = parser.parse_args()
 
-    print("✅ Conversion completed! YOLOv8 labels saved in", args.output_dir)
+    convert_folder(args.input_dir, args.output_dir, workers=args.workers, incremental=args.incremental,
+                   progress_every=args.progress_every)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,913 @@
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache, partial
+
+import cv2
+import numpy as np
+from metrics import METRICS
+
+# Trained weights produced by train_person_detection.py / train_ppe_detection.py
+PERSON_WEIGHTS = "weights/person_detection.pt"
+PPE_WEIGHTS = "weights/ppe_detection.pt"
+
+# Optional single-stage model trained by train_joint_detection.py on full frames
+JOINT_WEIGHTS = "weights/joint_detection.pt"
+
+# Define PPE class names
+PPE_CLASSES = ["hard-hat", "gloves", "mask", "glasses", "boots", "vest", "ppe-suit", "ear-protector", "safety-harness"]
+
+# Joint model classes (datasets/classes.txt order): person is 0, PPE class k is k + 1
+JOINT_CLASSES = ["person"] + PPE_CLASSES
+
+# PPE model input size and the largest number of person crops sent in one forward pass
+PPE_IMGSZ = 640
+MAX_PPE_BATCH = 16
+
+# Inference backends, fastest first on CPU. Exported artifacts live next to the .pt weights
+# (see model_export.py); "auto" picks the first one that exists, is not older than its .pt weights
+# and whose runtime is installed. INT8 is only picked by "auto" once model_export.py --compare has
+# recorded its mAP as close enough to the .pt model; set PPE_BACKEND=openvino-int8 to force it.
+BACKENDS = ["openvino-int8", "openvino", "onnx", "pt"]
+BACKEND_RUNTIMES = {"openvino-int8": "openvino", "openvino": "openvino", "onnx": "onnxruntime", "pt": "torch"}
+DEFAULT_BACKEND = os.environ.get("PPE_BACKEND", "auto")
+
+# Detection routes: "two-pass" always crops persons for the PPE model, "one-pass" uses only the
+# joint model, "auto" starts with the joint model and adds the PPE pass only when it is worth it
+ROUTES = ["two-pass", "one-pass", "auto"]
+DEFAULT_ROUTE = os.environ.get("PPE_ROUTE", "two-pass")
+
+# "auto" stays one-pass for crowded frames (more persons than this) or when every person is at
+# least this many pixels tall, i.e. large enough for the joint model to resolve their PPE
+ONE_PASS_MIN_PERSONS = 6
+ONE_PASS_MIN_HEIGHT = 320
+
+# Tiled person detection for high-resolution stills: "on" always tiles, "auto" tiles frames
+# whose long side is at least TILE_MIN_SIDE. Each frame costs one full-frame pass plus one pass
+# per tile, i.e. roughly one model call per (TILE_SIZE * (1 - TILE_OVERLAP))^2 pixels
+TILING_MODES = ["off", "on", "auto"]
+DEFAULT_TILING = os.environ.get("PPE_TILING", "off")
+TILE_SIZE = int(os.environ.get("PPE_TILE_SIZE", 640))
+TILE_OVERLAP = 0.2
+TILE_MIN_SIDE = 1920
+MAX_TILE_BATCH = 8
+
+# Detections from overlapping tiles are merged when their IoU reaches TILE_MERGE_IOU or one
+# lies this much inside the other (a person cut off at a tile edge)
+TILE_MERGE_IOU = 0.5
+TILE_MERGE_IOA = 0.8
+
+# Minimum share of a PPE box that must lie inside a person box to be assigned to that person
+MIN_PPE_OVERLAP = 0.5
+
+# Person crops grow by this fraction of the box width/height on every side (clamped to the
+# image) so hard hats and boots at the box edges are not cut off
+CROP_PADDING = float(os.environ.get("PPE_CROP_PADDING", 0.1))
+
+# Persons below this confidence are dropped; persons whose box is smaller than MIN_CROP_AREA
+# pixels or more elongated than MAX_CROP_ASPECT are kept but reported as unassessable and
+# never run through the PPE model
+MIN_PERSON_CONF = float(os.environ.get("PPE_MIN_PERSON_CONF", 0.25))
+MIN_CROP_AREA = int(os.environ.get("PPE_MIN_CROP_AREA", 32 * 64))
+MAX_CROP_ASPECT = 6.0
+
+# Colors (BGR) used when drawing results
+PERSON_COLOR = (255, 0, 0)
+PPE_COLOR = (0, 255, 0)
+UNASSESSABLE_COLOR = (128, 128, 128)
+BOX_THICKNESS = 2
+
+# Label style; each distinct label is rendered once and then copied into frames
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_SCALE = 0.7
+LABEL_THICKNESS = 2
+
+_models = {}
+_models_lock = threading.Lock()
+
+# Seconds this process spent importing ultralytics/torch, loading weights and warming up
+_startup_times = Counter()
+_startup_lock = threading.Lock()
+_YOLO = None
+
+
+def record_startup(phase, seconds):
+    with _startup_lock:
+        _startup_times[phase] += seconds
+        total = _startup_times[phase]
+    METRICS.set("ppe_startup_seconds", total, phase=phase)
+
+
+def startup_report():
+    """Returns the {phase: seconds} spent so far on the import, load and warmup phases."""
+    with _startup_lock:
+        return dict(_startup_times)
+
+
+def startup_line():
+    times = startup_report()
+    return " | ".join(f"{phase} {times[phase]:.2f}s" for phase in ["import", "load", "warmup"] if phase in times)
+
+
+def _yolo_class():
+    # ultralytics pulls in torch, which takes seconds; only pay for it when a model is needed.
+    # Called with _models_lock held, so the import runs once
+    global _YOLO
+    if _YOLO is None:
+        start = time.perf_counter()
+        from ultralytics import YOLO
+        _YOLO = YOLO
+        record_startup("import", time.perf_counter() - start)
+    return _YOLO
+
+
+def load_model(weights):
+    """Loads a YOLO model once per process and returns the cached instance."""
+    with _models_lock:
+        model = _models.get(weights)
+        if model is None:
+            yolo = _yolo_class()
+            start = time.perf_counter()
+            model = yolo(weights, task="detect")
+            _models[weights] = model
+            record_startup("load", time.perf_counter() - start)
+    return model
+
+
+def backend_weights(weights, backend):
+    """Returns where the `backend` artifact of a .pt weights file is (or would be) exported."""
+    root = os.path.splitext(weights)[0]
+    return {
+        "pt": weights,
+        "onnx": root + ".onnx",
+        "openvino": root + "_openvino_model",
+        "openvino-int8": root + "_int8_openvino_model",
+    }[backend]
+
+
+def artifact_mtime(path):
+    """Returns the modification time of a file, or of the newest file in a model directory."""
+    if os.path.isdir(path):
+        return max((os.path.getmtime(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names),
+                   default=os.path.getmtime(path))
+    return os.path.getmtime(path)
+
+
+def export_is_stale(weights, backend):
+    """True if the backend's artifact is older than the .pt weights, i.e. exported from a previous model."""
+    artifact = backend_weights(weights, backend)
+    return (backend != "pt" and os.path.exists(artifact) and os.path.exists(weights)
+            and artifact_mtime(artifact) < os.path.getmtime(weights))
+
+
+def compare_record_path(weights):
+    """Returns where model_export.compare_backends records its results for a .pt weights file."""
+    return os.path.splitext(weights)[0] + "_compare.json"
+
+
+def int8_accepted(weights):
+    """True if the last backend comparison of these exact weights found the INT8 mAP acceptable."""
+    path = compare_record_path(weights)
+    if not os.path.exists(path) or not os.path.exists(weights):
+        return False
+    with open(path) as f:
+        record = json.load(f)
+    return record.get("int8_accepted", False) and record.get("weights_mtime") == os.path.getmtime(weights)
+
+
+def backend_available(weights, backend):
+    """True if the backend's artifact exists, is up to date with the weights and its runtime package is installed."""
+    return (os.path.exists(backend_weights(weights, backend))
+            and not export_is_stale(weights, backend)
+            and importlib.util.find_spec(BACKEND_RUNTIMES[backend]) is not None)
+
+
+def resolve_weights(weights, backend=DEFAULT_BACKEND):
+    """Maps .pt weights to the artifact of the requested backend, or the fastest usable one for "auto"."""
+    if backend != "auto":
+        if export_is_stale(weights, backend):
+            print(f"⚠️ {backend_weights(weights, backend)} is older than {weights}; re-export it to serve the new model.")
+        return backend_weights(weights, backend)
+    for candidate in BACKENDS:
+        if export_is_stale(weights, candidate):
+            print(f"⚠️ Ignoring {backend_weights(weights, candidate)}: it is older than {weights}, re-export it.")
+            continue
+        if candidate == "openvino-int8" and not int8_accepted(weights):
+            continue
+        if backend_available(weights, candidate):
+            return backend_weights(weights, candidate)
+    return weights
+
+
+class LRUCache:
+    """Small thread-safe mapping that evicts the least recently used entry beyond `maxsize`.
+
+    A cache with a `name` reports its hits and misses as ppe_cache_requests_total{cache=name}.
+    """
+
+    def __init__(self, maxsize=64, name=None):
+        self.maxsize = maxsize
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            hit = key in self._data
+            if hit:
+                self._data.move_to_end(key)
+                value = self._data[key]
+        if self.name:
+            METRICS.inc("ppe_cache_requests_total", cache=self.name, result="hit" if hit else "miss")
+        return value if hit else default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+def content_key(data, settings=None):
+    """Returns a hex digest identifying `data` bytes together with the settings used on them."""
+    digest = hashlib.sha256(data)
+    if settings:
+        digest.update(repr(sorted(settings.items())).encode())
+    return digest.hexdigest()
+
+
+def ppe_label(class_id):
+    """Returns the PPE class name for a model class id."""
+    return PPE_CLASSES[class_id] if class_id < len(PPE_CLASSES) else "PPE"
+
+
+def box_iou(boxes_a, boxes_b):
+    """Returns the (len(a), len(b)) IoU matrix of two arrays of xyxy boxes."""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).prod(axis=1)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+@dataclass
+class DetectionResult:
+    """Person and PPE detections for one image, all boxes in full-image xyxy pixels."""
+    person_boxes: np.ndarray
+    person_scores: np.ndarray
+    ppe_boxes: np.ndarray
+    ppe_classes: np.ndarray
+    ppe_scores: np.ndarray
+    ppe_parents: np.ndarray  # Index into person_boxes of the person each PPE box was found on
+    person_assessable: np.ndarray = None  # False for persons too small to judge PPE for
+
+    def __post_init__(self):
+        if self.person_assessable is None:
+            self.person_assessable = np.ones(len(self.person_boxes), dtype=bool)
+
+    @property
+    def ppe_labels(self):
+        return [ppe_label(int(class_id)) for class_id in self.ppe_classes]
+
+    def ppe_for_person(self, person_idx):
+        """Returns a boolean mask selecting the PPE boxes of one person."""
+        return self.ppe_parents == person_idx
+
+
+def box_ioa(inner, outer):
+    """Returns the (len(inner), len(outer)) matrix of the fraction of each inner box inside each outer box."""
+    inner = np.asarray(inner, dtype=np.float32).reshape(-1, 4)
+    outer = np.asarray(outer, dtype=np.float32).reshape(-1, 4)
+
+    top_left = np.maximum(inner[:, None, :2], outer[None, :, :2])
+    bottom_right = np.minimum(inner[:, None, 2:], outer[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+
+    area = (inner[:, 2:] - inner[:, :2]).prod(axis=1)
+    return inter / np.maximum(area[:, None], 1e-9)
+
+
+def assign_to_persons(person_boxes, ppe_boxes, min_overlap=MIN_PPE_OVERLAP):
+    """Returns, for each PPE box, the index of the person box covering most of it, or -1 if none covers enough."""
+    if len(person_boxes) == 0:
+        return np.full(len(ppe_boxes), -1, dtype=int)
+    overlap = box_ioa(ppe_boxes, person_boxes)
+    parents = overlap.argmax(axis=1)
+    parents[overlap.max(axis=1, initial=0) < min_overlap] = -1
+    return parents
+
+
+def tile_grid(height, width, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Returns (K, 4) xyxy windows of at most `tile_size` pixels that cover the image, evenly
+    spaced so neighbours overlap by at least `overlap` of a tile."""
+    def starts(length):
+        if length <= tile_size:
+            return np.zeros(1, dtype=int)
+        count = int(np.ceil((length - tile_size) / (tile_size * (1 - overlap)))) + 1
+        return np.linspace(0, length - tile_size, count).round().astype(int)
+
+    y0, x0 = (grid.ravel() for grid in np.meshgrid(starts(height), starts(width), indexing="ij"))
+    return np.stack([x0, y0, np.minimum(x0 + tile_size, width), np.minimum(y0 + tile_size, height)], axis=1)
+
+
+def merge_boxes(boxes, scores, iou_threshold=TILE_MERGE_IOU, ioa_threshold=TILE_MERGE_IOA, method="nms"):
+    """Merges duplicate detections of overlapping tiles into one box each; returns (boxes, scores).
+
+    Boxes are clustered greedily by score: a box joins a higher-scoring one when their IoU
+    reaches `iou_threshold` or either lies `ioa_threshold` inside the other. "nms" keeps the
+    best box of a cluster, grown to cover the members that contain it (so a person cut at a
+    tile edge keeps its full extent); "wbf" averages the cluster's boxes weighted by score.
+    """
+    if len(boxes) == 0:
+        return boxes.reshape(0, 4), scores
+    order = np.argsort(-scores)
+    boxes, scores = boxes[order], scores[order]
+    ioa = box_ioa(boxes, boxes)  # ioa[i, j]: share of box i inside box j
+    same = (box_iou(boxes, boxes) >= iou_threshold) | (ioa >= ioa_threshold) | (ioa.T >= ioa_threshold)
+
+    merged_boxes, merged_scores = [], []
+    taken = np.zeros(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if taken[i]:
+            continue
+        members = same[i] & ~taken
+        taken |= members
+        if method == "wbf":
+            weights = scores[members, None]
+            merged_boxes.append((boxes[members] * weights).sum(axis=0) / weights.sum())
+        else:
+            cover = boxes[members & (ioa[i] >= ioa_threshold)]
+            merged_boxes.append(np.concatenate([cover[:, :2].min(axis=0), cover[:, 2:].max(axis=0)]))
+        merged_scores.append(scores[i])
+    return np.array(merged_boxes, dtype=np.float32), np.array(merged_scores, dtype=np.float32)
+
+
+def detect_persons_tiled(person_model, image, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                         max_batch_size=MAX_TILE_BATCH):
+    """Runs the person model on the full frame plus overlapping full-resolution tiles, batched,
+    and merges the detections into full-frame (boxes, scores)."""
+    windows = tile_grid(*image.shape[:2], tile_size, overlap)
+    inputs = [image] + [image[y1:y2, x1:x2] for x1, y1, x2, y2 in windows]
+    offsets = np.vstack([np.zeros((1, 4), dtype=int), windows[:, [0, 1, 0, 1]]]).astype(np.float32)
+    METRICS.observe("ppe_tiles_per_frame", len(windows))
+
+    boxes, scores = [], []
+    for start in range(0, len(inputs), max_batch_size):
+        results = person_model(inputs[start:start + max_batch_size], imgsz=tile_size)
+        for offset, result in zip(offsets[start:], results):
+            boxes.append(result.boxes.xyxy.cpu().numpy() + offset)
+            scores.append(result.boxes.conf.cpu().numpy())
+    return merge_boxes(np.concatenate(boxes), np.concatenate(scores))
+
+
+def expand_boxes(boxes, image_shape, padding=CROP_PADDING):
+    """Grows xyxy boxes by `padding` times their width/height on every side, clamped to the image."""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    pad = np.tile(boxes[:, 2:] - boxes[:, :2], 2) * padding * np.array([-1, -1, 1, 1], dtype=np.float32)
+    height, width = image_shape[:2]
+    return np.clip(boxes + pad, 0, np.array([width, height, width, height], dtype=np.float32))
+
+
+def assessable_persons(boxes, min_area=MIN_CROP_AREA, max_aspect=MAX_CROP_ASPECT):
+    """Returns a mask of the person boxes large and well-shaped enough to judge their PPE."""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    widths, heights = boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        aspect = np.maximum(heights / widths, widths / heights)
+    return (widths * heights >= min_area) & (aspect <= max_aspect)
+
+
+def _empty_ppe():
+    return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=int), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int)
+
+
+def collect_crops(images, crop_boxes_list, keep_list=None):
+    """Returns the person crops (views into the images) of several images and, per crop,
+    (image index, person index, xyxy offset) to map results back.
+
+    `keep_list` optionally holds one mask per image of the persons to crop at all."""
+    crops, owners = [], []
+    for image_idx, (image, crop_boxes) in enumerate(zip(images, crop_boxes_list)):
+        keep = keep_list[image_idx] if keep_list is not None else None
+        for idx, box in enumerate(crop_boxes):
+            if keep is not None and not keep[idx]:
+                continue
+            x1, y1, x2, y2 = map(int, box)
+            crop = image[y1:y2, x1:x2]
+            if crop.size == 0:
+                continue  # Degenerate box, nothing to run the PPE model on
+            crops.append(crop)
+            owners.append((image_idx, idx, (x1, y1, x1, y1)))
+    return crops, owners
+
+
+class LetterboxBuffer:
+    """Preallocated PPE model input that person ROIs are letterboxed into, reused across frames.
+
+    Each crop view is resized straight into its slot of one uint8 NHWC array (only the padding
+    strips around it are refilled), which is then converted into one float NCHW tensor that is
+    also kept. Boxes the model returns are in slot coordinates; unletterbox maps them back.
+    Not thread-safe: use one buffer per thread.
+    """
+
+    def __init__(self, capacity=MAX_PPE_BATCH, imgsz=PPE_IMGSZ, pad_value=114):
+        self.imgsz = imgsz
+        self.pad_value = pad_value
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        import torch
+
+        self.pixels = np.full((capacity, self.imgsz, self.imgsz, 3), self.pad_value, dtype=np.uint8)
+        self.tensor = torch.empty((capacity, 3, self.imgsz, self.imgsz), dtype=torch.float32)
+
+    def fill(self, rois):
+        """Letterboxes BGR `rois` into the buffer; returns the (n, 3, imgsz, imgsz) RGB input tensor
+        and per-ROI (scale, left, top) transforms."""
+        import torch
+
+        if len(rois) > len(self.pixels):
+            self._allocate(len(rois))
+
+        size = self.imgsz
+        transforms = np.empty((len(rois), 3), dtype=np.float32)
+        for i, roi in enumerate(rois):
+            height, width = roi.shape[:2]
+            scale = min(size / height, size / width)
+            new_w, new_h = max(1, round(width * scale)), max(1, round(height * scale))
+            left, top = (size - new_w) // 2, (size - new_h) // 2
+
+            slot = self.pixels[i]
+            slot[:top] = self.pad_value
+            slot[top + new_h:] = self.pad_value
+            slot[top:top + new_h, :left] = self.pad_value
+            slot[top:top + new_h, left + new_w:] = self.pad_value
+
+            inner = slot[top:top + new_h, left:left + new_w]
+            cv2.resize(roi, (new_w, new_h), dst=inner, interpolation=cv2.INTER_LINEAR)
+            cv2.cvtColor(inner, cv2.COLOR_BGR2RGB, dst=inner)
+            transforms[i] = scale, left, top
+
+        tensor = self.tensor[:len(rois)]
+        tensor.copy_(torch.from_numpy(self.pixels[:len(rois)]).permute(0, 3, 1, 2)).div_(255)
+        return tensor, transforms
+
+    @staticmethod
+    def unletterbox(boxes, transform, roi_shape):
+        """Maps xyxy boxes from slot coordinates back to ROI coordinates, clipped to the ROI."""
+        scale, left, top = transform
+        boxes = (boxes - np.array([left, top, left, top], dtype=boxes.dtype)) / scale
+        height, width = roi_shape[:2]
+        np.clip(boxes, 0, [width, height, width, height], out=boxes)
+        return boxes
+
+
+def detect_ppe_on_crops(ppe_model, crops, owners, num_images, max_batch_size=MAX_PPE_BATCH, imgsz=PPE_IMGSZ,
+                        buffer=None):
+    """Runs the PPE model over crops from collect_crops in chunks of at most `max_batch_size`.
+
+    Each chunk costs a single preprocess/forward/NMS round trip instead of one per person. With
+    a LetterboxBuffer the crops go straight into its reused input tensor; otherwise Ultralytics
+    letterboxes the list of crops to `imgsz` itself.
+
+    Returns one (boxes, classes, scores, parents) tuple per image: PPE boxes in full-image xyxy
+    coordinates, their class ids and confidences, and the index of the person each belongs to.
+    """
+    collected = [([], [], [], []) for _ in range(num_images)]
+    for start in range(0, len(crops), max_batch_size):
+        batch = crops[start:start + max_batch_size]
+        METRICS.observe("ppe_crops_per_batch", len(batch))
+        with METRICS.timer("ppe"):
+            if buffer is None:
+                ppe_results = ppe_model(batch, imgsz=imgsz)
+            else:
+                inputs, transforms = buffer.fill(batch)
+                ppe_results = ppe_model(inputs, imgsz=buffer.imgsz)
+
+        for crop_idx, ppe_result in enumerate(ppe_results, start=start):
+            ppe_boxes = ppe_result.boxes.xyxy.cpu().numpy()
+            if len(ppe_boxes) == 0:
+                continue
+            if buffer is not None:
+                ppe_boxes = buffer.unletterbox(ppe_boxes, transforms[crop_idx - start], crops[crop_idx].shape)
+
+            image_idx, parent, offset = owners[crop_idx]
+            all_boxes, all_classes, all_scores, all_parents = collected[image_idx]
+
+            # Map crop-relative boxes back to full-image coordinates
+            all_boxes.append(ppe_boxes + np.asarray(offset, dtype=ppe_boxes.dtype))
+            all_classes.append(ppe_result.boxes.cls.cpu().numpy().astype(int))
+            all_scores.append(ppe_result.boxes.conf.cpu().numpy())
+            all_parents.append(np.full(len(ppe_boxes), parent, dtype=int))
+
+    return [
+        tuple(np.concatenate(parts) for parts in image_parts) if image_parts[0] else _empty_ppe()
+        for image_parts in collected
+    ]
+
+
+def detect_ppe_multi(ppe_model, images, crop_boxes_list, max_batch_size=MAX_PPE_BATCH, imgsz=PPE_IMGSZ,
+                     buffer=None, keep_list=None):
+    """Runs the PPE model over the person crops of several images, pooled into shared batches."""
+    with METRICS.timer("crop"):
+        crops, owners = collect_crops(images, crop_boxes_list, keep_list)
+    return detect_ppe_on_crops(ppe_model, crops, owners, len(images), max_batch_size, imgsz, buffer)
+
+
+def detect_ppe_batched(ppe_model, image, crop_boxes, max_batch_size=MAX_PPE_BATCH, imgsz=PPE_IMGSZ,
+                       buffer=None, keep=None):
+    """Runs the PPE model over every person crop of one image; see detect_ppe_multi."""
+    return detect_ppe_multi(ppe_model, [image], [crop_boxes], max_batch_size, imgsz, buffer,
+                            None if keep is None else [keep])[0]
+
+
+class PPEPipeline:
+    """Two-stage person -> PPE detector shared by the app and the scripts.
+
+    Models are loaded lazily on first use and cached per process, so creating several
+    pipelines (or importing several scripts) never loads the same weights twice.
+
+    With a `route` other than "two-pass" the joint person + PPE model replaces the person
+    model as first stage; see route_one_pass for when "auto" skips the per-crop PPE pass.
+
+    With `tiling` on (or "auto" for frames of TILE_MIN_SIDE pixels and up), persons are
+    detected on overlapping `tile_size` tiles as well as the downscaled frame, so distant
+    workers in 4K-8K stills are not lost; see detect_persons_tiled.
+
+    Persons below `min_person_conf` are dropped. The rest are cropped with `crop_padding`,
+    and those failing the `min_crop_area` / `max_crop_aspect` check are reported as
+    unassessable (DetectionResult.person_assessable) without a PPE pass.
+    """
+
+    def __init__(self, person_weights=PERSON_WEIGHTS, ppe_weights=PPE_WEIGHTS,
+                 max_batch_size=MAX_PPE_BATCH, ppe_imgsz=PPE_IMGSZ, backend=DEFAULT_BACKEND,
+                 route=DEFAULT_ROUTE, joint_weights=JOINT_WEIGHTS,
+                 one_pass_min_persons=ONE_PASS_MIN_PERSONS, one_pass_min_height=ONE_PASS_MIN_HEIGHT,
+                 crop_padding=CROP_PADDING, min_person_conf=MIN_PERSON_CONF, min_crop_area=MIN_CROP_AREA,
+                 max_crop_aspect=MAX_CROP_ASPECT, tiling=DEFAULT_TILING, tile_size=TILE_SIZE,
+                 tile_overlap=TILE_OVERLAP, model_conf=None, model_iou=None):
+        if route not in ROUTES:
+            raise ValueError(f"Unknown route {route!r}, expected one of {ROUTES}")
+        if tiling not in TILING_MODES:
+            raise ValueError(f"Unknown tiling mode {tiling!r}, expected one of {TILING_MODES}")
+        self.person_weights = resolve_weights(person_weights, backend)
+        self.ppe_weights = resolve_weights(ppe_weights, backend)
+        self.joint_weights = resolve_weights(joint_weights, backend)
+        self.max_batch_size = max_batch_size
+        self.ppe_imgsz = ppe_imgsz
+        self.route = route
+        self.one_pass_min_persons = one_pass_min_persons
+        self.one_pass_min_height = one_pass_min_height
+        self.crop_padding = crop_padding
+        self.min_person_conf = min_person_conf
+        self.min_crop_area = min_crop_area
+        self.max_crop_aspect = max_crop_aspect
+        self.tiling = tiling
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.model_conf = model_conf
+        self.model_iou = model_iou
+        self.route_counts = Counter()
+        self._local = threading.local()
+        self._ready = None
+        self._load_error = None
+
+    @property
+    def predict_args(self):
+        """Confidence and NMS IoU thresholds passed to every model call (Ultralytics defaults when unset)."""
+        return {key: value for key, value in [("conf", self.model_conf), ("iou", self.model_iou)] if value is not None}
+
+    @property
+    def person_settings(self):
+        """Settings besides the weights that change the person detections."""
+        settings = dict(self.predict_args)
+        if self.tiling != "off":
+            settings.update(tiling=self.tiling, tile_size=self.tile_size, tile_overlap=self.tile_overlap)
+        return settings
+
+    @property
+    def settings(self):
+        """Inference settings that change the output, used as part of result cache keys."""
+        settings = {
+            "person_weights": self.person_weights,
+            "ppe_weights": self.ppe_weights,
+            "ppe_imgsz": self.ppe_imgsz,
+            "route": self.route,
+            "crop_padding": self.crop_padding,
+            "min_person_conf": self.min_person_conf,
+            "min_crop_area": self.min_crop_area,
+            "max_crop_aspect": self.max_crop_aspect,
+        }
+        settings.update(self.person_settings)
+        if self.route != "two-pass":
+            settings.update(joint_weights=self.joint_weights, one_pass_min_persons=self.one_pass_min_persons,
+                            one_pass_min_height=self.one_pass_min_height)
+        return settings
+
+    def load(self):
+        """Loads the models of the configured route now instead of on first use and returns the pipeline."""
+        if self.route != "one-pass":
+            load_model(self.ppe_weights)
+        load_model(self.person_weights if self.route == "two-pass" else self.joint_weights)
+        return self
+
+    def load_async(self, warmup=True):
+        """Loads (and warms up) the models on a background thread and returns the pipeline at once.
+
+        Callers can render a UI, open streams or list files meanwhile; detection calls wait
+        until loading has finished.
+        """
+        self._ready = threading.Event()
+
+        def run():
+            try:
+                self.load()
+                if warmup:
+                    self.warmup()
+                print(f"✅ Models ready ({startup_line()})", flush=True)
+            except Exception as e:
+                self._load_error = e
+            finally:
+                self._ready.set()
+
+        threading.Thread(target=run, name="model-load", daemon=True).start()
+        return self
+
+    @property
+    def ready(self):
+        """False while load_async is still loading the models."""
+        return self._ready is None or self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        """Blocks until load_async has finished; returns False on timeout and re-raises its error."""
+        if self._ready is None:
+            return True
+        if not self._ready.wait(timeout):
+            return False
+        if self._load_error is not None:
+            raise self._load_error
+        return True
+
+    def _model(self, weights):
+        model = load_model(weights)
+        return partial(model, **self.predict_args) if self.predict_args else model
+
+    @property
+    def person_model(self):
+        return self._model(self.person_weights)
+
+    @property
+    def ppe_model(self):
+        return self._model(self.ppe_weights)
+
+    @property
+    def joint_model(self):
+        return self._model(self.joint_weights)
+
+    @property
+    def letterbox_buffer(self):
+        """This thread's reusable PPE input buffer, so concurrent callers never share one."""
+        buffer = getattr(self._local, "letterbox_buffer", None)
+        if buffer is None or buffer.imgsz != self.ppe_imgsz:
+            buffer = self._local.letterbox_buffer = LetterboxBuffer(self.max_batch_size, self.ppe_imgsz)
+        return buffer
+
+    def warmup(self, size=640):
+        """Runs the route's models once on blank inputs shaped like real ones (a frame for the
+        person or joint model, a letterboxed crop tensor for the PPE model), so the first real
+        request doesn't pay for predictor and backend setup."""
+        start = time.perf_counter()
+        dummy = np.zeros((size, size, 3), dtype=np.uint8)
+        frame_model = self.person_model if self.route == "two-pass" else self.joint_model
+        frame_model(dummy, verbose=False)
+        if self.route != "one-pass":
+            # A one-slot buffer, so warming up on another thread doesn't keep a full-size one around
+            buffer = LetterboxBuffer(1, self.ppe_imgsz)
+            self.ppe_model(buffer.fill([dummy])[0], imgsz=buffer.imgsz, verbose=False)
+        record_startup("warmup", time.perf_counter() - start)
+
+    def detect_persons(self, image, filtered=True):
+        """Returns (boxes, scores) of the persons found in a BGR image, at or above
+        min_person_conf unless `filtered` is off."""
+        with METRICS.timer("person"):
+            if self.use_tiles(image):
+                person_boxes, person_scores = detect_persons_tiled(self.person_model, image, self.tile_size,
+                                                                   self.tile_overlap)
+            else:
+                boxes = self.person_model(image)[0].boxes
+                person_boxes, person_scores = boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy()
+        if filtered:
+            person_boxes, person_scores = self.filter_persons(person_boxes, person_scores)
+        METRICS.observe("ppe_persons_per_frame", len(person_boxes))
+        return person_boxes, person_scores
+
+    def use_tiles(self, image):
+        if self.tiling == "auto":
+            return max(image.shape[:2]) >= TILE_MIN_SIDE
+        return self.tiling == "on"
+
+    def filter_persons(self, person_boxes, person_scores):
+        """Drops person detections below min_person_conf."""
+        keep = person_scores >= self.min_person_conf
+        return person_boxes[keep], person_scores[keep]
+
+    def crop_boxes(self, image_shape, person_boxes):
+        """Returns the padded crop box and the assessable flag of every person."""
+        assessable = assessable_persons(person_boxes, self.min_crop_area, self.max_crop_aspect)
+        METRICS.inc("ppe_unassessable_persons_total", int((~assessable).sum()))
+        return expand_boxes(person_boxes, image_shape, self.crop_padding), assessable
+
+    def detect_ppe(self, image, person_boxes, assessable=None):
+        """Returns (boxes, classes, scores, parents) of the PPE worn by the given persons,
+        skipping those that are not `assessable`."""
+        crop_boxes = expand_boxes(person_boxes, image.shape, self.crop_padding)
+        return detect_ppe_batched(self.ppe_model, image, crop_boxes, max_batch_size=self.max_batch_size,
+                                  imgsz=self.ppe_imgsz, buffer=self.letterbox_buffer, keep=assessable)
+
+    def detect_two_pass(self, image, person_boxes, person_scores):
+        """Runs the PPE pass on the assessable persons and builds the DetectionResult."""
+        _, assessable = self.crop_boxes(image.shape, person_boxes)
+        ppe = self.detect_ppe(image, person_boxes, assessable)
+        return DetectionResult(person_boxes, person_scores, *ppe, person_assessable=assessable)
+
+    def route_one_pass(self, person_boxes):
+        """Decides whether the joint model's own PPE boxes are good enough for this frame.
+
+        Crowded frames would pay one PPE forward pass per person, and persons that are all
+        tall enough are resolved well by the joint model, so both stay one-pass.
+        """
+        if self.route != "auto":
+            return self.route == "one-pass"
+        if len(person_boxes) > self.one_pass_min_persons:
+            return True
+        heights = person_boxes[:, 3] - person_boxes[:, 1]
+        return len(heights) > 0 and heights.min() >= self.one_pass_min_height
+
+    def detect_joint(self, image):
+        """Runs the joint model and routes the frame one-pass or two-pass."""
+        with METRICS.timer("joint"):
+            boxes = self.joint_model(image)[0].boxes
+        xyxy = boxes.xyxy.cpu().numpy()
+        classes = boxes.cls.cpu().numpy().astype(int)
+        scores = boxes.conf.cpu().numpy()
+
+        is_person = classes == 0
+        person_boxes, person_scores = self.filter_persons(xyxy[is_person], scores[is_person])
+        METRICS.observe("ppe_persons_per_frame", len(person_boxes))
+
+        if not self.route_one_pass(person_boxes):
+            self.count_route("two-pass")
+            return self.detect_two_pass(image, person_boxes, person_scores)
+
+        # Keep the joint model's PPE boxes, attached to the assessable person that covers them most
+        self.count_route("one-pass")
+        _, assessable = self.crop_boxes(image.shape, person_boxes)
+        ppe_boxes = xyxy[~is_person]
+        ppe_parents = assign_to_persons(person_boxes, ppe_boxes)
+        keep = ppe_parents >= 0
+        keep[keep] = assessable[ppe_parents[keep]]
+        return DetectionResult(person_boxes, person_scores, ppe_boxes[keep], classes[~is_person][keep] - 1,
+                               scores[~is_person][keep], ppe_parents[keep], assessable)
+
+    def count_route(self, route, frames=1):
+        self.route_counts[route] += frames
+        METRICS.inc("ppe_frames_total", frames, route=route)
+
+    def detect(self, image):
+        """Runs the full person -> PPE pipeline on a BGR image."""
+        self.wait_ready()
+        with METRICS.request("detect"):
+            if self.route != "two-pass":
+                return self.detect_joint(image)
+
+            self.count_route("two-pass")
+            person_boxes, person_scores = self.detect_persons(image)
+            return self.detect_two_pass(image, person_boxes, person_scores)
+
+    def detect_batch(self, images):
+        """Runs the pipeline on several images with one person-model batch and pooled PPE batches."""
+        if not images:
+            return []
+        self.wait_ready()
+        if self.route != "two-pass":
+            return [self.detect(image) for image in images]
+
+        with METRICS.request("detect_batch"):
+            self.count_route("two-pass", len(images))
+            if any(self.use_tiles(image) for image in images):
+                persons = [self.detect_persons(image) for image in images]
+            else:
+                with METRICS.timer("person"):
+                    person_results = self.person_model(list(images))
+                persons = [self.filter_persons(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy())
+                           for r in person_results]
+                for boxes, _ in persons:
+                    METRICS.observe("ppe_persons_per_frame", len(boxes))
+            crops = [self.crop_boxes(image.shape, boxes) for image, (boxes, _) in zip(images, persons)]
+
+            ppe = detect_ppe_multi(self.ppe_model, images, [crop for crop, _ in crops],
+                                   max_batch_size=self.max_batch_size, imgsz=self.ppe_imgsz,
+                                   buffer=self.letterbox_buffer, keep_list=[keep for _, keep in crops])
+        return [
+            DetectionResult(boxes, scores, *image_ppe, person_assessable=assessable)
+            for (boxes, scores), (_, assessable), image_ppe in zip(persons, crops, ppe)
+        ]
+
+    def detect_crop(self, image):
+        """Runs only the PPE model on an image that is already a single person crop."""
+        self.wait_ready()
+        height, width = image.shape[:2]
+        person_boxes = np.array([[0, 0, width, height]], dtype=np.float32)
+        ppe_boxes, ppe_classes, ppe_scores, ppe_parents = self.detect_ppe(image, person_boxes)
+        return DetectionResult(person_boxes, np.ones(1, dtype=np.float32),
+                               ppe_boxes, ppe_classes, ppe_scores, ppe_parents)
+
+
+@lru_cache(maxsize=256)
+def label_sprite(text, font_scale=LABEL_SCALE, font_thickness=LABEL_THICKNESS, text_color=(0, 255, 0),
+                 bg_color=(0, 0, 0), font=LABEL_FONT):
+    """Returns `text` pre-rendered on its background as a read-only BGR patch, built once per label and style.
+
+    The baseline sits 5 px above the bottom edge, where cv2.putText at (x + 5, y - 5) would put it.
+    """
+    (width, height), _ = cv2.getTextSize(text, font, font_scale, font_thickness)
+    sprite = np.empty((height + 10, width + 10, 3), dtype=np.uint8)
+    sprite[:] = bg_color
+    cv2.putText(sprite, text, (5, height + 5), font, font_scale, text_color, font_thickness)
+    sprite.flags.writeable = False
+    return sprite
+
+
+def blit(image, sprite, x, y):
+    """Copies `sprite` into `image` with its bottom-left corner at (x, y), shifted to stay inside the image."""
+    img_height, img_width = image.shape[:2]
+    height, width = sprite.shape[:2]
+    x0 = min(max(x, 0), max(img_width - width, 0))
+    y0 = min(max(y - height, 0), max(img_height - height, 0))
+    patch = image[y0:y0 + height, x0:x0 + width]
+    patch[...] = sprite[:patch.shape[0], :patch.shape[1]]
+
+
+def draw_text_with_bg(img, text, x, y, font=LABEL_FONT,
+                      font_scale=LABEL_SCALE, font_thickness=LABEL_THICKNESS, text_color=(0, 255, 0), bg_color=(0, 0, 0)):
+    """Draws text with a background for better visibility."""
+    blit(img, label_sprite(text, font_scale, font_thickness, text_color, bg_color, font), x, y)
+
+
+def draw_rectangles(image, boxes, color, thickness=BOX_THICKNESS):
+    """Draws the outlines of all xyxy `boxes` with a single cv2.polylines call."""
+    boxes = np.asarray(boxes).reshape(-1, 4).astype(np.int32)
+    if len(boxes) == 0:
+        return
+    corners = boxes[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+    cv2.polylines(image, list(corners), True, color, thickness)
+
+
+def draw_detections(image, result, draw_persons=True, font_scale=LABEL_SCALE):
+    """Draws person and PPE boxes of a DetectionResult onto `image` in place and returns it."""
+    with METRICS.timer("draw"):
+        _draw_boxes(image, result, draw_persons, font_scale)
+    return image
+
+
+def _draw_boxes(image, result, draw_persons, font_scale):
+    # All outlines first, then the labels on top so no box line crosses a label
+    person_boxes = np.asarray(result.person_boxes).reshape(-1, 4)
+    assessable = result.person_assessable
+    if draw_persons:
+        draw_rectangles(image, person_boxes[assessable], PERSON_COLOR)
+        draw_rectangles(image, person_boxes[~assessable], UNASSESSABLE_COLOR)
+    draw_rectangles(image, result.ppe_boxes, PPE_COLOR)
+
+    if draw_persons and len(person_boxes):
+        sprites = [label_sprite("Too small", font_scale, text_color=UNASSESSABLE_COLOR),
+                   label_sprite("Person", font_scale, text_color=PERSON_COLOR)]
+        for (x, y), is_assessable in zip(person_boxes[:, :2].astype(int), assessable):
+            blit(image, sprites[int(is_assessable)], x, y)
+
+    if len(result.ppe_boxes):
+        sprites = {
+            class_id: label_sprite(ppe_label(int(class_id)), font_scale, text_color=PPE_COLOR)
+            for class_id in np.unique(result.ppe_classes)
+        }
+        for (x, y), class_id in zip(np.asarray(result.ppe_boxes)[:, :2].astype(int), result.ppe_classes):
+            blit(image, sprites[class_id], x, y)
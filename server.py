@@ -0,0 +1,195 @@
+import asyncio
+import os
+import uuid
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import cv2
+import numpy as np
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from detection_output import detection_record
+from inference import save_result
+from metrics import METRICS, start_periodic_log
+from ppe_pipeline import PPEPipeline, draw_detections, startup_report
+
+# Micro-batching and backpressure settings
+MAX_BATCH = int(os.environ.get("PPE_MAX_BATCH", 8))
+MAX_WAIT_MS = float(os.environ.get("PPE_MAX_WAIT_MS", 5))
+MAX_QUEUE = int(os.environ.get("PPE_MAX_QUEUE", 64))
+
+# Annotated images for the optional HTML front end
+RESULT_FOLDER = "static/results"
+
+class QueueFullError(Exception):
+    pass
+
+class MicroBatcher:
+    """Gathers concurrent detection requests for up to `max_wait_ms` into one pipeline batch.
+
+    Each batch costs one person-model forward pass plus pooled PPE passes over all crops.
+    The queue is bounded: when `max_queue` requests are already waiting, new ones are
+    rejected immediately instead of piling up latency.
+    """
+
+    def __init__(self, pipeline, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, max_queue=MAX_QUEUE):
+        self.pipeline = pipeline
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        # Models run on a single dedicated thread so the event loop stays responsive
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.images = 0
+
+    async def detect(self, image):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((image, future))
+        except asyncio.QueueFull:
+            METRICS.inc("ppe_rejected_requests_total")
+            raise QueueFullError() from None
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            images = [image for image, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.pipeline.detect_batch, images)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.images += len(batch)
+            METRICS.observe("ppe_server_batch_size", len(batch))
+            for (_, future), result in zip(batch, results):
+                if not future.done():  # The client may have disconnected
+                    future.set_result(result)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Models load and warm up in the background; /ready reports when they can serve traffic
+    pipeline = PPEPipeline().load_async()
+    app.state.batcher = MicroBatcher(pipeline)
+    worker = asyncio.create_task(app.state.batcher.run())
+    start_periodic_log()
+    yield
+    worker.cancel()
+    app.state.batcher.executor.shutdown(wait=False)
+
+app = FastAPI(title="PPE Detection", lifespan=lifespan)
+app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = Jinja2Templates(directory="templates")
+
+async def decode_upload(file):
+    data = await file.read()
+    if not data:
+        # cv2.imdecode raises on an empty buffer instead of returning None
+        raise HTTPException(status_code=400, detail="Empty upload")
+    image = await asyncio.get_running_loop().run_in_executor(
+        None, cv2.imdecode, np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    return image
+
+async def run_detection(request, image):
+    try:
+        return await request.app.state.batcher.detect(image)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Server busy, retry shortly",
+                            headers={"Retry-After": "1"}) from None
+
+@app.post("/detect")
+async def detect(request: Request, file: UploadFile = File(...)):
+    """Returns person and PPE detections for an uploaded image as JSON."""
+    image = await decode_upload(file)
+    result = await run_detection(request, image)
+    return JSONResponse(detection_record(file.filename, result))
+
+@app.get("/health")
+async def health(request: Request):
+    batcher = request.app.state.batcher
+    return {
+        "queue_depth": batcher.queue.qsize(),
+        "max_queue": batcher.queue.maxsize,
+        "batches": batcher.batches,
+        "images": batcher.images,
+        "mean_batch_size": batcher.images / batcher.batches if batcher.batches else 0.0,
+        "ready": batcher.pipeline.ready,
+        "startup_seconds": startup_report(),
+    }
+
+@app.get("/ready")
+async def ready(request: Request):
+    """Readiness probe: 503 until the models are loaded and warmed up."""
+    if not request.app.state.batcher.pipeline.ready:
+        raise HTTPException(status_code=503, detail="Models are loading", headers={"Retry-After": "1"})
+    return {"ready": True, "startup_seconds": startup_report()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """Stage timings, batch sizes and counters in the Prometheus text format."""
+    METRICS.set("ppe_queue_depth", request.app.state.batcher.queue.qsize())
+    return METRICS.render()
+
+# Optional HTML front end
+def render_result(image, result, output_path):
+    """Draws the detections and writes the annotated image, off the event loop."""
+    draw_detections(image, result)
+    return save_result(image, output_path)
+
+@app.get("/")
+async def index(request: Request):
+    return templates.TemplateResponse(request, "index.html")
+
+@app.get("/upload")
+async def upload_form(request: Request):
+    return templates.TemplateResponse(request, "upload.html")
+
+@app.post("/upload")
+async def upload(request: Request, file: UploadFile = File(...)):
+    image = await decode_upload(file)
+    result = await run_detection(request, image)
+
+    os.makedirs(RESULT_FOLDER, exist_ok=True)
+    filename = f"{uuid.uuid4().hex}.jpg"
+    await asyncio.get_running_loop().run_in_executor(
+        None, render_result, image, result, os.path.join(RESULT_FOLDER, filename))
+    return templates.TemplateResponse(request, "result.html", {"image": filename})
+
+@app.get("/results/{filename}")
+async def get_result_image(filename: str):
+    path = os.path.join(RESULT_FOLDER, os.path.basename(filename))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Result not found")
+    return FileResponse(path, media_type="image/jpeg")
+
+def main():
+    import uvicorn
+
+    parser = ArgumentParser(description="Serve person and PPE detection over HTTP.")
+    parser.add_argument("--host", default="0.0.0.0", help="Interface to bind.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on.")
+    args = parser.parse_args()
+
+    uvicorn.run(app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,18 @@
 import cv2
-from ultralytics import YOLO
+from ppe_pipeline import PPEPipeline, draw_detections
 
-# Load trained PPE model
-ppe_model = YOLO("weights/ppe_detection.pt")
+# PPE detection pipeline (only the PPE model is used here)
+pipeline = PPEPipeline()
 
 # Load a cropped person image
 image_path = "datasets/cropped_persons/train/cropped_0.jpg"  # Replace with an actual cropped image
 image = cv2.imread(image_path)
 
 # Run PPE detection
-results = ppe_model(image)
+result = pipeline.detect_crop(image)
 
 # Draw bounding boxes
-for r in results:
-    boxes = r.boxes.xyxy.cpu().numpy()
-    classes = r.boxes.cls.cpu().numpy()
-    
-    for i, box in enumerate(boxes):
-        x1, y1, x2, y2 = map(int, box)
-        label = PPE_CLASSES[int(classes[i])]
-        cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-        cv2.putText(image, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+draw_detections(image, result, draw_persons=False)
 
 # Save and show the output
 cv2.imwrite("results/test_ppe.jpg", image)
@@ -0,0 +1,85 @@
+import time
+import cv2
+import numpy as np
+from ppe_pipeline import DetectionResult
+from video_inference import FrameReader, stream_detections
+
+NUM_FRAMES = 12
+FRAME_SIZE = (160, 120)
+
+
+def write_video(path, num_frames=NUM_FRAMES):
+    """Writes a small synthetic video: a bright block moving right on a dark background."""
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 10, FRAME_SIZE)
+    for idx in range(num_frames):
+        frame = np.zeros((FRAME_SIZE[1], FRAME_SIZE[0], 3), dtype=np.uint8)
+        cv2.rectangle(frame, (10 + 5 * idx, 20), (40 + 5 * idx, 100), (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+class StubPipeline:
+    """Stands in for PPEPipeline: one person moving 15 px per call with a hard hat on its head."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def detect(self, image):
+        x = 10 + 15 * self.calls
+        self.calls += 1
+        return DetectionResult(
+            np.array([[x, 20, x + 30, 100]], dtype=np.float32),
+            np.array([0.9], dtype=np.float32),
+            np.array([[x + 5, 20, x + 25, 35]], dtype=np.float32),
+            np.array([0]),
+            np.array([0.8], dtype=np.float32),
+            np.array([0]),
+        )
+
+
+def test_stream_detections_carries_ppe_forward(tmp_path):
+    capture = cv2.VideoCapture(str(write_video(tmp_path / "synthetic.avi")))
+    assert capture.isOpened()
+    reader = FrameReader(capture, maxsize=4, drop_stale=False)
+    reader.start()
+
+    pipeline = StubPipeline()
+    frames = list(stream_detections(reader, pipeline=pipeline, detect_every=3))
+    capture.release()
+
+    assert [frame_idx for frame_idx, *_ in frames] == list(range(NUM_FRAMES))
+    assert [detected for *_, detected in frames] == [True, False, False] * (NUM_FRAMES // 3)
+    assert pipeline.calls == NUM_FRAMES // 3
+    assert reader.dropped == 0
+
+    # Between detections the PPE box keeps its offset from the (tracked) person box
+    for _, _, result, track_ids, _ in frames:
+        assert len(result.person_boxes) == 1 and len(result.ppe_boxes) == 1
+        np.testing.assert_allclose(result.ppe_boxes - result.person_boxes[result.ppe_parents], [[5, 0, -5, -65]])
+        assert list(track_ids) == [0]
+
+    # From the second detection on the tracker knows the velocity and moves the person 5 px per frame
+    carried = [result.person_boxes[0, 0] for _, _, result, _, _ in frames[3:6]]
+    np.testing.assert_allclose(carried, [25, 30, 35])
+
+
+def test_frame_reader_drop_stale_bounds_queue(tmp_path):
+    capture = cv2.VideoCapture(str(write_video(tmp_path / "synthetic.avi")))
+    reader = FrameReader(capture, maxsize=2, drop_stale=True)
+    reader.start()
+
+    # Nothing consumes until the whole video has been read, so all but the newest frames are dropped
+    deadline = time.monotonic() + 10
+    while reader.dropped < NUM_FRAMES - 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+        assert reader.frames.qsize() <= 2
+
+    items = []
+    while (item := reader.frames.get(timeout=5)) is not None:
+        items.append(item)
+    reader.join(timeout=5)
+    capture.release()
+
+    assert reader.dropped == NUM_FRAMES - 2
+    assert [frame_idx for frame_idx, _ in items] == [NUM_FRAMES - 2, NUM_FRAMES - 1]
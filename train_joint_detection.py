@@ -0,0 +1,116 @@
+from ultralytics import YOLO
+from argparse import ArgumentParser
+import os
+import shutil
+from convert_ppe_annotations import split_for
+from model_export import EXPORT_FORMATS, compare_backends, export_model
+from pack_dataset import PackedDetectionTrainer, ensure_packs, image_files
+from pascalVOC_to_yolo import convert_folder
+from ppe_pipeline import JOINT_CLASSES, JOINT_WEIGHTS
+
+def get_latest_model():
+    runs_dir = "runs/detect"
+    if not os.path.exists(runs_dir):
+        return None
+
+    subfolders = [f for f in os.listdir(runs_dir) if f.startswith("joint_detection")]
+    if not subfolders:
+        return None
+
+    # Extract numeric part safely
+    def extract_number(folder_name):
+        num_part = folder_name.replace("joint_detection", "").strip()
+        return int(num_part) if num_part.isdigit() else 0  # Default to 0 if empty
+
+    # Sort folders by extracted number
+    latest_folder = sorted(subfolders, key=extract_number)[-1]
+
+    return os.path.join(runs_dir, latest_folder, "weights", "best.pt")
+
+def write_split_lists(dataset_dir):
+    """Splits the frames of dataset_dir/images into train.txt and val.txt image lists by the same
+    stable hash as the crop dataset, so validation runs on frames the model was not trained on."""
+    image_paths = image_files(os.path.join(dataset_dir, "images"))
+    splits = {"train": [], "val": []}
+    for path in image_paths:
+        splits[split_for(os.path.basename(path))].append(os.path.abspath(path))
+    for split, paths in splits.items():
+        with open(os.path.join(dataset_dir, f"{split}.txt"), "w") as f:
+            f.writelines(path + "\n" for path in paths)
+    print(f"✅ Split {len(image_paths)} frames into {len(splits['train'])} train and {len(splits['val'])} val")
+    return {split: len(paths) for split, paths in splits.items()}
+
+def write_dataset_yaml(dataset_dir, yaml_path):
+    """Writes a dataset YAML for full frames labelled with person plus the nine PPE classes."""
+    with open(yaml_path, "w") as f:
+        f.write(f"path: {os.path.abspath(dataset_dir)}\n")
+        f.write("train: train.txt\n")
+        f.write("val: val.txt\n")
+        f.write(f"nc: {len(JOINT_CLASSES)}\n")
+        f.write(f"names: {JOINT_CLASSES}\n")
+
+def main():
+    parser = ArgumentParser(description="Train a single-stage YOLOv8 model for persons and PPE on full frames.")
+    parser.add_argument("--dataset", default="datasets", help="Folder with images/, labels/*.xml and classes.txt.")
+    parser.add_argument("--data", default="datasets/joint_dataset.yaml", help="Dataset YAML to write and train on.")
+    parser.add_argument("--epochs", type=int, default=50, help="Number of training epochs.")
+    parser.add_argument("--imgsz", type=int, default=640, help="Image size for training.")
+    parser.add_argument("--batch", type=int, default=16, help="Batch size.")
+    parser.add_argument("--export", choices=EXPORT_FORMATS, help="Also export an optimized CPU model after training.")
+    parser.add_argument("--int8", action="store_true", help="INT8-quantize the export, calibrating on the dataset images.")
+    parser.add_argument("--compare", action="store_true", help="Compare mAP and speed of all available exports against the .pt model.")
+    parser.add_argument("--packed", action="store_true",
+                        help="Pack the dataset into memory-mapped caches (once) and train from them.")
+    args = parser.parse_args()
+
+    # classes.txt must list person followed by the PPE classes in pipeline order
+    with open(os.path.join(args.dataset, "classes.txt")) as f:
+        classes = [line.strip() for line in f if line.strip()]
+    if classes != JOINT_CLASSES:
+        print(f"❌ Error: {args.dataset}/classes.txt must be {JOINT_CLASSES}, found {classes}!")
+        return
+
+    # Refresh the YOLO labels next to the images from the XML annotations
+    if convert_folder(args.dataset, os.path.join(args.dataset, "labels"), incremental=True) is None:
+        return
+    counts = write_split_lists(args.dataset)
+    if not counts["train"] or not counts["val"]:
+        print("❌ Error: Need frames in both the train and the val split to train!")
+        return
+    write_dataset_yaml(args.dataset, args.data)
+
+    if args.packed:
+        ensure_packs(args.data, imgsz=args.imgsz)
+
+    # Load YOLOv8 model
+    model = YOLO("yolov8n.pt")  # Use a pre-trained YOLOv8 model
+
+    # Train the model
+    model.train(
+        data=args.data,
+        epochs=args.epochs,
+        imgsz=args.imgsz,
+        batch=args.batch,
+        name="joint_detection",
+        trainer=PackedDetectionTrainer if args.packed else None
+    )
+
+    # Ensure weights directory exists
+    os.makedirs("weights", exist_ok=True)
+
+    # Get the latest trained model path
+    best_model = get_latest_model()
+
+    if best_model and os.path.exists(best_model):
+        shutil.move(best_model, JOINT_WEIGHTS)
+        print(f"✅ Joint Model training complete! Saved as {JOINT_WEIGHTS}")
+
+        if args.export:
+            export_model(JOINT_WEIGHTS, args.export, data=args.data, imgsz=args.imgsz, int8=args.int8)
+        if args.compare:
+            compare_backends(JOINT_WEIGHTS, args.data, imgsz=args.imgsz)
+    else:
+        print("❌ Error: Trained model not found!")
+
+if __name__ == "__main__":
+    main()
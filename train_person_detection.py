@@ -1,6 +1,8 @@
 from ultralytics import YOLO
 from argparse import ArgumentParser
 import os
+from model_export import EXPORT_FORMATS, compare_backends, export_model
+from pack_dataset import PackedDetectionTrainer, ensure_packs
 
 def get_latest_model():
     runs_dir = "runs/detect"
@@ -28,8 +30,16 @@ def main():
     parser.add_argument("--epochs", type=int, default=50, help="Number of training epochs.")
     parser.add_argument("--imgsz", type=int, default=640, help="Image size for training.")
     parser.add_argument("--batch", type=int, default=16, help="Batch size.")
+    parser.add_argument("--export", choices=EXPORT_FORMATS, help="Also export an optimized CPU model after training.")
+    parser.add_argument("--int8", action="store_true", help="INT8-quantize the export, calibrating on the dataset images.")
+    parser.add_argument("--compare", action="store_true", help="Compare mAP and speed of all available exports against the .pt model.")
+    parser.add_argument("--packed", action="store_true",
+                        help="Pack the dataset into memory-mapped caches (once) and train from them.")
     args = parser.parse_args()
 
+    if args.packed:
+        ensure_packs(args.data, imgsz=args.imgsz)
+
     # Load YOLOv8 model
     model = YOLO("yolov8n.pt")  # Use a pre-trained YOLOv8 model
 
@@ -39,7 +49,8 @@ def main():
         epochs=args.epochs,
         imgsz=args.imgsz,
         batch=args.batch,
-        name="person_detection"
+        name="person_detection",
+        trainer=PackedDetectionTrainer if args.packed else None
     )
 
     # Ensure weights directory exists
@@ -51,6 +62,11 @@ def main():
     if best_model and os.path.exists(best_model):
         print(f"✅ Model training complete! Saved as {best_model}")
         os.rename(best_model, "weights/person_detection.pt")
+
+        if args.export:
+            export_model("weights/person_detection.pt", args.export, data=args.data, imgsz=args.imgsz, int8=args.int8)
+        if args.compare:
+            compare_backends("weights/person_detection.pt", args.data, imgsz=args.imgsz)
     else:
         print("❌ Error: Trained model not found!")
 
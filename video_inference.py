@@ -0,0 +1,236 @@
+import cv2
+import os
+import queue
+import threading
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+import numpy as np
+from compliance import ComplianceRules, ComplianceSummary, evaluate_result, hour_of
+from detection_output import JsonlWriter, detection_record
+from metrics import METRICS, METRICS_LOG_EVERY, start_periodic_log
+from ppe_pipeline import DetectionResult, PPEPipeline, box_iou, draw_detections
+
+class FrameReader(threading.Thread):
+    """Reads frames from a cv2.VideoCapture into a bounded queue on a background thread.
+
+    With `drop_stale` the oldest queued frame is discarded when the queue is full, so a
+    slow consumer always works on recent frames instead of building up a backlog.
+    """
+
+    def __init__(self, capture, maxsize=8, drop_stale=True):
+        super().__init__(daemon=True)
+        self.capture = capture
+        self.frames = queue.Queue(maxsize=maxsize)
+        self.drop_stale = drop_stale
+        self.dropped = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        frame_idx = 0
+        while not self._stopped.is_set():
+            ok, frame = self.capture.read()
+            if not ok:
+                break
+
+            if self.drop_stale:
+                while True:
+                    try:
+                        self.frames.put_nowait((frame_idx, frame))
+                        break
+                    except queue.Full:
+                        try:
+                            self.frames.get_nowait()
+                            self.dropped += 1
+                        except queue.Empty:
+                            pass
+            else:
+                self.frames.put((frame_idx, frame))
+            frame_idx += 1
+
+        self.frames.put(None)  # End of stream
+
+    def stop(self):
+        self._stopped.set()
+
+class PersonTracker:
+    """Greedy IoU tracker with constant-velocity prediction for frames without detection."""
+
+    def __init__(self, iou_threshold=0.3):
+        self.iou_threshold = iou_threshold
+        self.detected_boxes = np.zeros((0, 4), dtype=np.float32)
+        self.velocities = np.zeros((0, 4), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=int)
+        self.frames_since_update = 0
+        self._next_id = 0
+
+    def update(self, boxes):
+        """Matches new detections to existing tracks and returns their track ids."""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        ids = np.full(len(boxes), -1, dtype=int)
+        velocities = np.zeros_like(boxes)
+        steps = self.frames_since_update + 1
+
+        if len(boxes) and len(self.detected_boxes):
+            # Match against where each track is expected to be in this frame
+            iou = box_iou(boxes, self.detected_boxes + self.velocities * steps)
+            # Greedily take the best remaining pair until overlaps fall below the threshold
+            for _ in range(min(iou.shape)):
+                det_idx, track_idx = np.unravel_index(np.argmax(iou), iou.shape)
+                if iou[det_idx, track_idx] < self.iou_threshold:
+                    break
+                ids[det_idx] = self.ids[track_idx]
+                velocities[det_idx] = (boxes[det_idx] - self.detected_boxes[track_idx]) / steps
+                iou[det_idx, :] = -1
+                iou[:, track_idx] = -1
+
+        new_tracks = ids < 0
+        ids[new_tracks] = np.arange(self._next_id, self._next_id + new_tracks.sum())
+        self._next_id += int(new_tracks.sum())
+
+        self.detected_boxes, self.velocities, self.ids = boxes, velocities, ids
+        self.frames_since_update = 0
+        return ids
+
+    def predict(self):
+        """Advances every track by one frame and returns the predicted boxes."""
+        self.frames_since_update += 1
+        return self.detected_boxes + self.velocities * self.frames_since_update
+
+def carry_forward(result, person_boxes):
+    """Moves a DetectionResult to new person boxes, shifting PPE boxes with their person."""
+    shift = (person_boxes - result.person_boxes)[result.ppe_parents]
+    return DetectionResult(person_boxes, result.person_scores, result.ppe_boxes + shift,
+                           result.ppe_classes, result.ppe_scores, result.ppe_parents, result.person_assessable)
+
+def stream_detections(reader, pipeline=None, detect_every=1):
+    """Yields (frame_idx, frame, result, track_ids, detected) for each frame from a FrameReader.
+
+    Full person -> PPE detection runs on every `detect_every`-th processed frame; in between,
+    person boxes are carried forward by the tracker and PPE boxes follow their person.
+    """
+    pipeline = pipeline or PPEPipeline()
+    tracker = PersonTracker()
+
+    last_result = None
+    processed = 0
+    while True:
+        item = reader.frames.get()
+        if item is None:
+            break
+        frame_idx, frame = item
+
+        detected = last_result is None or processed % detect_every == 0
+        if detected:
+            last_result = pipeline.detect(frame)
+            track_ids = tracker.update(last_result.person_boxes)
+            result = last_result
+        else:
+            result = carry_forward(last_result, tracker.predict())
+            track_ids = tracker.ids
+
+        processed += 1
+        yield frame_idx, frame, result, track_ids, detected
+
+def frame_record(frame_idx, result, track_ids, detected, camera=None, timestamp=None):
+    """Builds the per-frame results record: the image record plus frame bookkeeping."""
+    record = detection_record(frame_idx, result, track_ids)
+    record["frame"] = frame_idx
+    record["detected"] = detected
+    record["camera"] = camera
+    record["timestamp"] = timestamp
+    return record
+
+def open_source(source):
+    """Opens a video file, RTSP/HTTP URL or camera index; returns (capture, is_live)."""
+    if source.isdigit():
+        return cv2.VideoCapture(int(source)), True
+    return cv2.VideoCapture(source), not os.path.isfile(source)
+
+def recording_start(source, capture, fps, start_time=None):
+    """Returns the UNIX time of the first frame of a video file: `start_time` (ISO 8601, local time)
+    if given, else the file's modification time minus its duration, as a recording is written last
+    when it ends."""
+    if start_time:
+        return datetime.fromisoformat(start_time).timestamp()
+    duration = max(capture.get(cv2.CAP_PROP_FRAME_COUNT), 0) / fps
+    return os.path.getmtime(source) - duration
+
+def main():
+    parser = ArgumentParser(description="Run person and PPE detection on a video file or stream.")
+    parser.add_argument("source", help="Video file, RTSP/HTTP stream URL or camera index.")
+    parser.add_argument("--output", default="results/annotated.mp4",
+                        help="Path of the annotated output video; empty to only write results.")
+    parser.add_argument("--results", default="results/frames.jsonl", help="Path of the per-frame JSONL results.")
+    parser.add_argument("--detect-every", type=int, default=1, help="Run full detection every N frames and track in between.")
+    parser.add_argument("--queue-size", type=int, default=8, help="Maximum number of frames waiting for inference.")
+    parser.add_argument("--drop-stale", choices=["auto", "yes", "no"], default="auto",
+                        help="Drop the oldest queued frames under load (auto: only for live streams).")
+    parser.add_argument("--camera", help="Camera name stored in the results and compliance summary (default: source name).")
+    parser.add_argument("--summary", help="Compliance summary file to add every frame to (see compliance.py).")
+    parser.add_argument("--rules", help="JSON rules file with the required PPE per camera.")
+    parser.add_argument("--start-time",
+                        help="Recording start of a video file, e.g. 2026-10-18T14:00:00 (default: file time minus duration).")
+    parser.add_argument("--metrics-every", type=float, default=METRICS_LOG_EVERY,
+                        help="Print a stage timing summary every N seconds (0 disables).")
+    args = parser.parse_args()
+
+    # Load the models while the source is opened and the first frames are read
+    pipeline = PPEPipeline().load_async()
+    capture, is_live = open_source(args.source)
+    if not capture.isOpened():
+        print(f"❌ Error: Could not open video source {args.source}!")
+        return
+
+    drop_stale = is_live if args.drop_stale == "auto" else args.drop_stale == "yes"
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    writer = None
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        writer = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+
+    camera = args.camera or os.path.splitext(os.path.basename(args.source.rstrip("/")))[0]
+    summary = ComplianceSummary.load(args.summary) if args.summary else None
+    required = ComplianceRules.load(args.rules).required(camera)
+
+    # Live frames are stamped when processed; file frames by their position in the recording,
+    # so a replayed video lands in the hours it was recorded, not the hour it was analysed
+    video_start = None if is_live else recording_start(args.source, capture, fps, args.start_time)
+
+    reader = FrameReader(capture, maxsize=args.queue_size, drop_stale=drop_stale)
+    reader.start()
+    start_periodic_log(args.metrics_every)
+
+    start = time.perf_counter()
+    frames = 0
+    with JsonlWriter(args.results) as results_file:
+        for frame_idx, frame, result, track_ids, detected in stream_detections(
+                reader, pipeline=pipeline, detect_every=max(args.detect_every, 1)):
+            if writer:
+                draw_detections(frame, result)
+                with METRICS.timer("write"):
+                    writer.write(frame)
+            timestamp = time.time() if video_start is None else video_start + frame_idx / fps
+            results_file.write_record(frame_record(frame_idx, result, track_ids, detected, camera, timestamp))
+            if summary:
+                summary.add(camera, hour_of(timestamp), evaluate_result(result, required))
+            frames += 1
+
+    reader.stop()
+    if writer:
+        writer.release()
+    capture.release()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Processed {frames} frames ({reader.dropped} dropped) in {elapsed:.1f}s "
+          f"({frames / elapsed:.2f} fps). Video saved to {args.output or '(not rendered)'}, results to {args.results}")
+    if summary:
+        summary.save(args.summary)
+        print(f"📊 Compliance summary updated in {args.summary}")
+    print(METRICS.log_line())
+
+if __name__ == "__main__":
+    main()